@@ -4,45 +4,809 @@ Async Travel Parser - Maximum performance version with async/await and batching
 """
 
 import os
+import sys
 import csv
+import hashlib
 import json
+import operator
+import random
 import re
-import glob
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple, Optional
+from functools import lru_cache
+from itertools import compress
+from typing import Any, Callable, List, Dict, Tuple, Optional, FrozenSet, TextIO, Union
 import openai
 from pathlib import Path
 import email
 from email.header import decode_header
+from email.utils import parsedate_to_datetime
 from bs4 import BeautifulSoup
 import asyncio
-import aiofiles
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from multiprocessing import cpu_count
 import time
 import aiohttp
 import logging
 import argparse
+from contextlib import asynccontextmanager, nullcontext
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from llm_cache import DEFAULT_CACHE_PATH, LLMCache, request_key
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# libuv-based event loop when installed (not available on Windows); stdlib asyncio loop otherwise
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Configure logging - per-entry detail goes through the logger so it costs nothing when the level is off
+logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 # Load OpenAI API key
 def load_openai_key():
     env_path = Path(__file__).parent / '.env'
     if env_path.exists():
-        with open(env_path, 'r') as f:
-            for line in f:
-                if line.startswith('OPEN_AI_KEY='):
-                    return line.split('=', 1)[1].strip()
+        # One read and one scan for the key at the start of a line
+        data = '\n' + env_path.read_text()
+        start = data.find('\nOPEN_AI_KEY=')
+        if start >= 0:
+            start += len('\nOPEN_AI_KEY=')
+            end = data.find('\n', start)
+            return data[start:end if end >= 0 else None].strip()
     return None
 
-# Initialize OpenAI
-openai.api_key = load_openai_key()
+# Initialize OpenAI on first parser construction rather than at import
+_openai_key_loaded = False
+
+def ensure_openai_key():
+    """Load the OpenAI API key from .env once"""
+    global _openai_key_loaded
+    if not _openai_key_loaded:
+        openai.api_key = load_openai_key()
+        _openai_key_loaded = True
+
+# Used when an entry has no usable departure time
+MIDNIGHT = datetime.min.time()
+
+def parse_iso_date(date_str: str) -> datetime:
+    """Parse a 'YYYY-MM-DD' date string (C fromisoformat fast path, strptime for anything else)"""
+    if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-':
+        try:
+            return datetime.fromisoformat(date_str)
+        except ValueError:
+            pass
+    return datetime.strptime(date_str, '%Y-%m-%d')
+
+def parse_departure_dates(entries: List[Dict]) -> List[Optional[datetime]]:
+    """Parse each entry's departure date once (None where it is missing or malformed)"""
+    dates = []
+    for entry in entries:
+        try:
+            dates.append(parse_iso_date(entry['departure_date']))
+        except Exception:
+            dates.append(None)
+    return dates
+
+def cities_connect_gap(current_arrival: str, next_departure: str, entry_departure: str, entry_arrival: str) -> bool:
+    """Check if an entry's (lowercased) cities connect a gap's (lowercased) locations"""
+    # Simple connection logic - can be enhanced
+    return (current_arrival in entry_departure or entry_departure in current_arrival) and \
+           (next_departure in entry_arrival or entry_arrival in next_departure)
+
+def index_entries_by_date(entries: List[Dict]) -> Tuple[List[datetime], List[int]]:
+    """Entry positions sorted by departure date, with the sorted dates alongside (undated entries left out)"""
+    dated = sorted((date, i) for i, date in enumerate(parse_departure_dates(entries)) if date is not None)
+    return [date for date, _ in dated], [i for _, i in dated]
+
+# Email text kept per travel email once it has been screened; AI prompts use at most the first 1500 characters
+MAX_EMAIL_CHARS = 4000
+
+# Shared decoder for pulling JSON out of AI responses
+JSON_DECODER = json.JSONDecoder()
+
+# Decode whole-JSON replies with orjson when it is installed (its JSONDecodeError subclasses json's)
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Gap and period prompts ask for a JSON object; JSON mode makes the model return nothing else
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+def parse_json_object(text: str) -> Optional[Dict]:
+    """Decode an AI reply as a JSON object, salvaging one wrapped in prose if the reply isn't pure JSON"""
+    try:
+        result = json_loads(text)
+    except json.JSONDecodeError:
+        # Decode from each '{' until one opens a complete object; the decoder stops where that
+        # object closes, so braces in strings or trailing prose can't throw the match off
+        start = text.find('{')
+        while start != -1:
+            try:
+                result, _ = JSON_DECODER.raw_decode(text, start)
+                break
+            except json.JSONDecodeError:
+                start = text.find('{', start + 1)
+        else:
+            return None
+    return result if isinstance(result, dict) else None
+
+def parse_json_array(text: str) -> Optional[List]:
+    """Decode an AI reply as a JSON array (None if there is none), salvaging one wrapped in prose"""
+    try:
+        result = json_loads(text)
+    except json.JSONDecodeError:
+        # As parse_json_object: the first '[' that opens a complete array wins and trailing prose is ignored
+        start = text.find('[')
+        while start != -1:
+            try:
+                result, _ = JSON_DECODER.raw_decode(text, start)
+                break
+            except json.JSONDecodeError:
+                start = text.find('[', start + 1)
+        else:
+            return None
+    return result if isinstance(result, list) else None
+
+# Parsed emails are cached as JSON next to the LLM cache, keyed by absolute file path and checked
+# against mtime/size. Bump EMAIL_CACHE_VERSION whenever parsing changes what an email parses to
+EMAIL_CACHE_PATH = os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), 'parsed_emails.json')
+EMAIL_CACHE_VERSION = 2
+
+# CSV file buffer for reads and writes (bytes)
+CSV_BUFFER_SIZE = 1 << 20
+
+# Travel CSV columns whose values repeat across rows
+SHARED_VALUE_COLUMNS = (
+    'departure_country', 'departure_city', 'departure_date', 'departure_time',
+    'arrival_country', 'arrival_city', 'arrival_date', 'arrival_time'
+)
+
+# Common country name variations by lowercase ISO 3166-1 alpha-2 code, used as email search keywords
+COUNTRY_VARIATIONS = {
+    'gb': ('united kingdom', 'uk', 'britain', 'england', 'scotland', 'wales'),
+    'us': ('united states', 'usa', 'america'),
+    'th': ('thailand',),
+    'my': ('malaysia',),
+    'sg': ('singapore',),
+    'id': ('indonesia',),
+    'ph': ('philippines',),
+    'vn': ('vietnam',),
+    'kh': ('cambodia',),
+    'la': ('laos',),
+    'mm': ('myanmar', 'burma'),
+    'bn': ('brunei',),
+    'fr': ('france',),
+    'de': ('germany',),
+    'it': ('italy',),
+    'es': ('spain',),
+    'nl': ('netherlands', 'holland'),
+    'be': ('belgium',),
+    'ch': ('switzerland',),
+    'at': ('austria',),
+    'dk': ('denmark',),
+    'se': ('sweden',),
+    'no': ('norway',),
+    'fi': ('finland',),
+    'pl': ('poland',),
+    'cz': ('czech republic', 'czechia'),
+    'hu': ('hungary',),
+    'sk': ('slovakia',),
+    'si': ('slovenia',),
+    'hr': ('croatia',),
+    'rs': ('serbia',),
+    'bg': ('bulgaria',),
+    'ro': ('romania',),
+    'gr': ('greece',),
+    'tr': ('turkey',),
+    'ru': ('russia',),
+    'ua': ('ukraine',),
+    'by': ('belarus',),
+    'lt': ('lithuania',),
+    'lv': ('latvia',),
+    'ee': ('estonia',),
+    'ie': ('ireland',),
+    'pt': ('portugal',),
+    'lu': ('luxembourg',),
+    'mt': ('malta',),
+    'cy': ('cyprus',),
+    'is': ('iceland',),
+    'li': ('liechtenstein',),
+    'mc': ('monaco',),
+    'ad': ('andorra',),
+    'sm': ('san marino',),
+    'va': ('vatican',),
+    'jp': ('japan',),
+    'kr': ('south korea', 'korea'),
+    'cn': ('china',),
+    'tw': ('taiwan',),
+    'hk': ('hong kong',),
+    'mo': ('macau',),
+    'in': ('india',),
+    'pk': ('pakistan',),
+    'bd': ('bangladesh',),
+    'lk': ('sri lanka',),
+    'mv': ('maldives',),
+    'np': ('nepal',),
+    'bt': ('bhutan',),
+    'af': ('afghanistan',),
+    'ir': ('iran',),
+    'iq': ('iraq',),
+    'sy': ('syria',),
+    'lb': ('lebanon',),
+    'jo': ('jordan',),
+    'il': ('israel',),
+    'ps': ('palestine',),
+    'sa': ('saudi arabia',),
+    'ae': ('united arab emirates', 'uae'),
+    'qa': ('qatar',),
+    'kw': ('kuwait',),
+    'bh': ('bahrain',),
+    'om': ('oman',),
+    'ye': ('yemen',),
+    'eg': ('egypt',),
+    'ly': ('libya',),
+    'tn': ('tunisia',),
+    'dz': ('algeria',),
+    'ma': ('morocco',),
+    'sd': ('sudan',),
+    'ss': ('south sudan',),
+    'et': ('ethiopia',),
+    'er': ('eritrea',),
+    'dj': ('djibouti',),
+    'so': ('somalia',),
+    'ke': ('kenya',),
+    'ug': ('uganda',),
+    'tz': ('tanzania',),
+    'rw': ('rwanda',),
+    'bi': ('burundi',),
+    'mw': ('malawi',),
+    'zm': ('zambia',),
+    'zw': ('zimbabwe',),
+    'bw': ('botswana',),
+    'na': ('namibia',),
+    'za': ('south africa',),
+    'sz': ('swaziland', 'eswatini'),
+    'ls': ('lesotho',),
+    'mg': ('madagascar',),
+    'mu': ('mauritius',),
+    'sc': ('seychelles',),
+    'km': ('comoros',),
+    'mz': ('mozambique',),
+    'ao': ('angola',),
+    'cd': ('congo', 'democratic republic of congo'),
+    'cg': ('congo', 'republic of congo'),
+    'cf': ('central african republic',),
+    'td': ('chad',),
+    'cm': ('cameroon',),
+    'gq': ('equatorial guinea',),
+    'ga': ('gabon',),
+    'st': ('sao tome and principe',),
+    'gh': ('ghana',),
+    'tg': ('togo',),
+    'bj': ('benin',),
+    'ne': ('niger',),
+    'bf': ('burkina faso',),
+    'ml': ('mali',),
+    'sn': ('senegal',),
+    'gm': ('gambia',),
+    'gw': ('guinea-bissau',),
+    'gn': ('guinea',),
+    'sl': ('sierra leone',),
+    'lr': ('liberia',),
+    'ci': ('ivory coast', "cote d'ivoire"),
+    'ca': ('canada',),
+    'mx': ('mexico',),
+    'gt': ('guatemala',),
+    'bz': ('belize',),
+    'sv': ('el salvador',),
+    'hn': ('honduras',),
+    'ni': ('nicaragua',),
+    'cr': ('costa rica',),
+    'pa': ('panama',),
+    'cu': ('cuba',),
+    'jm': ('jamaica',),
+    'ht': ('haiti',),
+    'do': ('dominican republic',),
+    'pr': ('puerto rico',),
+    'tt': ('trinidad and tobago',),
+    'bb': ('barbados',),
+    'ag': ('antigua and barbuda',),
+    'dm': ('dominica',),
+    'gd': ('grenada',),
+    'kn': ('saint kitts and nevis',),
+    'lc': ('saint lucia',),
+    'vc': ('saint vincent and the grenadines',),
+    'bs': ('bahamas',),
+    'ar': ('argentina',),
+    'bo': ('bolivia',),
+    'br': ('brazil',),
+    'cl': ('chile',),
+    'co': ('colombia',),
+    'ec': ('ecuador',),
+    'fk': ('falkland islands',),
+    'gf': ('french guiana',),
+    'gy': ('guyana',),
+    'py': ('paraguay',),
+    'pe': ('peru',),
+    'sr': ('suriname',),
+    'uy': ('uruguay',),
+    've': ('venezuela',),
+    'au': ('australia',),
+    'nz': ('new zealand',),
+    'fj': ('fiji',),
+    'pg': ('papua new guinea',),
+    'sb': ('solomon islands',),
+    'vu': ('vanuatu',),
+    'nc': ('new caledonia',),
+    'pf': ('french polynesia',),
+    'ws': ('samoa',),
+    'to': ('tonga',),
+    'ki': ('kiribati',),
+    'tv': ('tuvalu',),
+    'nr': ('nauru',),
+    'pw': ('palau',),
+    'fm': ('micronesia',),
+    'mh': ('marshall islands',),
+    'as': ('american samoa',),
+    'gu': ('guam',),
+    'mp': ('northern mariana islands',),
+    'vi': ('us virgin islands',),
+    'vg': ('british virgin islands',),
+    'ai': ('anguilla',),
+    'aw': ('aruba',),
+    'bq': ('bonaire',),
+    'cw': ('curacao',),
+    'sx': ('sint maarten',),
+    'bl': ('saint barthelemy',),
+    'mf': ('saint martin',),
+    'gp': ('guadeloupe',),
+    'mq': ('martinique',),
+    're': ('reunion',),
+    'yt': ('mayotte',),
+    'sh': ('saint helena',),
+    'ac': ('ascension island',),
+    'ta': ('tristan da cunha',),
+    'gs': ('south georgia and the south sandwich islands',),
+    'hm': ('heard island and mcdonald islands',),
+    'tf': ('french southern territories',),
+    'aq': ('antarctica',),
+    'bv': ('bouvet island',),
+    'sj': ('svalbard and jan mayen',),
+    'gl': ('greenland',),
+    'fo': ('faroe islands',),
+    'ax': ('aland islands',),
+    'je': ('jersey',),
+    'gg': ('guernsey',),
+    'im': ('isle of man',),
+    'gi': ('gibraltar',),
+    'md': ('moldova',),
+    'al': ('albania',),
+    'me': ('montenegro',),
+    'ba': ('bosnia and herzegovina',),
+}
+
+# Native-language names that normalize to a country code but aren't used as search keywords
+NATIVE_COUNTRY_NAMES = {
+    'DE': ('DEUTSCHLAND', 'ALLEMAGNE'),
+    'ES': ('ESPANA',),
+    'IT': ('ITALIA',),
+    'NL': ('NEDERLAND', 'NEDERLANDEN'),
+    'BE': ('BELGIE',),
+    'CH': ('SCHWEIZ', 'SUISSE', 'SVIZZERA'),
+    'AT': ('OSTERREICH',),
+    'DK': ('DANMARK',),
+    'SE': ('SVERIGE',),
+    'NO': ('NORGE',),
+    'FI': ('SUOMI',),
+    'IS': ('ISLAND',),
+    'IE': ('EIRE',),
+    'PL': ('POLSKA',),
+    'CZ': ('CESKA REPUBLIKA',),
+    'HU': ('MAGYARORSZAG',),
+    'SK': ('SLOVENSKO',),
+    'SI': ('SLOVENIJA',),
+    'HR': ('HRVATSKA',),
+    'RS': ('SRBIJA',),
+    'GR': ('ELLADA',),
+    'TR': ('TURKIYE',),
+    'RU': ('ROSSIYA',),
+    'UA': ('UKRAINA',),
+    'JP': ('NIPPON',),
+}
+
+# Uppercase country name -> ISO 3166-1 alpha-2 code, derived from the tables above
+COUNTRY_NAME_TO_CODE = {
+    name.upper(): code.upper() for code, names in COUNTRY_VARIATIONS.items() for name in names
+}
+COUNTRY_NAME_TO_CODE.update((name, code) for code, names in NATIVE_COUNTRY_NAMES.items() for name in names)
+COUNTRY_NAME_TO_CODE['CONGO'] = 'CD'  # listed under both CD and CG
+
+def parse_email_date(date_str: str) -> Optional[datetime]:
+    """Parse an RFC 2822 Date header to the (naive, midnight) calendar date it was sent on"""
+    if not date_str:
+        return None
+    try:
+        sent = parsedate_to_datetime(date_str)
+    except Exception:
+        # Headers without a time of day, e.g. 'Mon, 05 Feb 2024'
+        try:
+            return datetime.strptime(date_str.split(',')[-1].strip()[:11], '%d %b %Y')
+        except Exception:
+            return None
+    # Keep the sender's calendar date, comparable with the naive dates in the travel data
+    return datetime(sent.year, sent.month, sent.day)
+
+def list_email_files(email_dir: str) -> List[str]:
+    """Paths of the .eml files in a directory, sorted (one scandir pass, no glob pattern matching)"""
+    try:
+        with os.scandir(email_dir) as entries:
+            # Hidden files are skipped, as glob's '*.eml' would. Sorting makes the AI batches (and so
+            # their prompts and cache keys) the same on every run, whatever order the filesystem lists
+            return sorted(entry.path for entry in entries
+                          if entry.name.endswith('.eml') and not entry.name.startswith('.') and entry.is_file())
+    except OSError:
+        return []
+
+def read_email_file(email_file: str) -> bytes:
+    """Read an .eml file's raw bytes (blocking - run it in an executor from async code)"""
+    with open(email_file, 'rb') as f:
+        return f.read()
+
+# Prefer the C-backed lxml tree builder for email HTML; fall back to the pure-Python parser
+try:
+    import lxml.html
+    HTML_PARSER = 'lxml'
+except ImportError:
+    lxml = None
+    HTML_PARSER = 'html.parser'
+
+# Elements whose text BeautifulSoup's get_text() leaves out
+NON_TEXT_TAGS = ('script', 'style', 'template', 'rp', 'rt')
+
+def html_to_text(html_content: str) -> str:
+    """Strip the markup from an HTML email part"""
+    if lxml is not None:
+        # Walk the lxml tree directly rather than building a BeautifulSoup tree on top of it
+        try:
+            document = lxml.html.document_fromstring(html_content)
+        except Exception:
+            document = None  # empty documents or ones with an encoding declaration
+        if document is not None:
+            for element in list(document.iter(*NON_TEXT_TAGS)):
+                element.drop_tree()
+            return str(document.text_content())
+    return BeautifulSoup(html_content, HTML_PARSER).get_text()
+
+def decode_part_payload(part) -> str:
+    """Decode a MIME part's payload with its declared charset (UTF-8 if missing or unknown)"""
+    payload = part.get_payload(decode=True) or b''
+    try:
+        return payload.decode(part.get_content_charset() or 'utf-8', errors='ignore')
+    except LookupError:
+        return payload.decode('utf-8', errors='ignore')
+
+def email_body_digest(content: str) -> bytes:
+    """Short hash of an email body with case and whitespace differences folded away"""
+    return hashlib.blake2b(' '.join(content.lower().split()).encode('utf-8'), digest_size=8).digest()
+
+def compile_keyword_pattern(keywords: List[str]) -> re.Pattern:
+    """Compile keywords into one prefix-trie regex that matches if any keyword occurs in a string"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def build(node: Dict) -> str:
+        # A keyword ending here already matches - longer keywords sharing the prefix add nothing
+        if '' in node:
+            return ''
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+    
+    # No keywords must never match (an empty pattern would match everything)
+    return re.compile(build(trie) if trie else '(?!)')
+
+def _decode_header_parts(header_value: str) -> str:
+    """Decode an RFC 2047 encoded header value"""
+    if not header_value:
+        return ""
+    
+    decoded_parts = decode_header(header_value)
+    decoded_string = ""
+    for part, encoding in decoded_parts:
+        if isinstance(part, bytes):
+            if encoding:
+                try:
+                    decoded_string += part.decode(encoding)
+                except:
+                    decoded_string += part.decode('utf-8', errors='ignore')
+            else:
+                decoded_string += part.decode('utf-8', errors='ignore')
+        else:
+            decoded_string += part
+    
+    return decoded_string
+
+# Sender and subject headers repeat heavily across a mailbox
+_decode_header_cached = lru_cache(maxsize=16384)(_decode_header_parts)
+
+def decode_email_header(header_value: str) -> str:
+    """Decode email header value"""
+    if isinstance(header_value, str):
+        # Plain headers without encoded words decode to themselves
+        if '=?' not in header_value:
+            return header_value
+        return _decode_header_cached(header_value)
+    # Header objects (raw non-ASCII bytes) aren't hashable
+    return _decode_header_parts(header_value)
+
+def parse_email_bytes(content: bytes, email_file: str) -> Optional[Dict]:
+    """Parse a raw .eml file into subject, sender, date and plain-text content (runs in worker processes)"""
+    try:
+        # Parse the raw bytes; each part is decoded once with its own charset
+        msg = email.message_from_bytes(content)
+        
+        # Extract headers
+        subject = decode_email_header(msg.get('Subject', ''))
+        sender = decode_email_header(msg.get('From', ''))
+        date_str = msg.get('Date', '')
+        
+        # Parse date
+        email_date = parse_email_date(date_str)
+        
+        # Extract content
+        content_text = ""
+        if msg.is_multipart():
+            # HTML alternatives of a plain-text body repeat the same text - skip parsing them
+            skipped_parts = set()
+            for part in msg.walk():
+                content_type = part.get_content_type()
+                if content_type == "multipart/alternative":
+                    alternatives = part.get_payload()
+                    if any(alt.get_content_type() == "text/plain" for alt in alternatives):
+                        skipped_parts.update(id(alt) for alt in alternatives if alt.get_content_type() == "text/html")
+                elif content_type == "text/plain":
+                    content_text += decode_part_payload(part)
+                elif content_type == "text/html" and id(part) not in skipped_parts:
+                    html_content = decode_part_payload(part)
+                    content_text += html_to_text(html_content)
+        else:
+            if msg.get_content_type() == "text/plain":
+                content_text = decode_part_payload(msg)
+            elif msg.get_content_type() == "text/html":
+                html_content = decode_part_payload(msg)
+                content_text += html_to_text(html_content)
+        
+        return {
+            'file': email_file,
+            'subject': subject,
+            'sender': sender,
+            'date': email_date,
+            'content': content_text.strip()
+        }
+        
+    except Exception as e:
+        return None
+
+def encode_cached_email(result: Optional[Dict]) -> Optional[Dict]:
+    """Parsed email as JSON-ready data for the email cache (the date as an ISO string)"""
+    if result is None or result['date'] is None:
+        return result
+    return dict(result, date=result['date'].isoformat())
+
+def decode_cached_email(result: Optional[Dict]) -> Optional[Dict]:
+    """Parsed email read back from the email cache"""
+    if result is None or result['date'] is None:
+        return result
+    return dict(result, date=datetime.fromisoformat(result['date']))
+
+def parse_email_file(email_file: str) -> Optional[Dict]:
+    """Read and parse a .eml file (runs in worker processes, so the raw bytes never cross the pipe)"""
+    try:
+        content = read_email_file(email_file)
+    except Exception as e:
+        return None
+    return parse_email_bytes(content, email_file)
+
+# Parenthesized airport codes / country info, e.g. 'Doha (DOH)'
+_PAREN_RE = re.compile(r'\s*\([^)]*\)')
+
+# Two-letter country code in parentheses, e.g. 'London (GB)'
+_COUNTRY_RE = re.compile(r'\(([A-Z]{2})\)')
+_CITY_STRIP_RE = re.compile(r'\s*\([A-Z]{2}\)')
+
+@lru_cache(maxsize=4096)
+def _extract_city_name(city_string: str) -> str:
+    """Extract city name from city string (cached - the same raw city strings repeat across entries)"""
+    # Remove airport codes in parentheses
+    city = _PAREN_RE.sub('', city_string) if '(' in city_string else city_string
+    # Remove country info after dash
+    city = city.partition(' - ')[0].partition(',')[0]
+    return city.strip()
+
+@lru_cache(maxsize=4096)
+def _city_match_key(city_string: str) -> str:
+    """Lowercased city name used to compare consecutive entries (cached per raw city string)"""
+    return _extract_city_name(city_string).lower()
+
+@lru_cache(maxsize=4096)
+def _extract_country(location: str) -> str:
+    """Country code from a location string, or the whole string if it has none (cached per location)"""
+    # Look for country code in parentheses
+    match = _COUNTRY_RE.search(location)
+    if match:
+        return match.group(1)
+    
+    # If no country code, return the full location
+    return location
+
+@lru_cache(maxsize=4096)
+def _extract_city(location: str) -> str:
+    """Location string with its country code removed (cached per location)"""
+    # Remove country code in parentheses
+    return _CITY_STRIP_RE.sub('', location).strip()
+
+@lru_cache(maxsize=4096)
+def _normalize_country_code(country_code: str) -> str:
+    """ISO 3166-1 alpha-2 code for a country code or name (cached per raw value)"""
+    if not country_code:
+        return 'Unknown'
+    
+    country_code = country_code.strip().upper()
+    if not country_code:
+        return 'Unknown'
+    
+    # Known country names map to their code; anything else (including
+    # codes that are already ISO 3166-1 alpha-2) is returned as-is
+    return COUNTRY_NAME_TO_CODE.get(country_code, country_code)
+
+# OpenAI rate limits to stay under (gpt-4o defaults); requests wait for capacity instead of hitting 429s
+OPENAI_REQUESTS_PER_MINUTE = 500
+OPENAI_TOKENS_PER_MINUTE = 30000
+OPENAI_MAX_BACKOFF = 60  # seconds
+OPENAI_DNS_CACHE_TTL = 300  # seconds
+
+# Transient OpenAI failures that are retried with backoff
+RETRYABLE_OPENAI_ERRORS = (
+    openai.error.RateLimitError, openai.error.APIConnectionError, openai.error.Timeout,
+    openai.error.ServiceUnavailableError, openai.error.TryAgain, openai.error.APIError
+)
+
+def estimate_tokens(text: str, max_tokens: int) -> int:
+    """Rough token cost of a request: ~4 characters per prompt token plus the completion budget"""
+    return len(text) // 4 + max_tokens
+
+# Instructions for batch email extraction. They are identical on every request and the gaps
+# context only changes between runs, so both go ahead of the emails; the prompt then shares
+# one long prefix across a run's batches, which the API's automatic prompt caching reuses
+EMAIL_BATCH_PROMPT_PREFIX = """Please analyze the emails below and extract any travel information that could fill the gaps listed. Look for:
+- Flight bookings, confirmations, itineraries
+- Hotel reservations and check-ins
+- Car rentals, train tickets, bus bookings
+- Car lifts, informal transportation
+- Any travel between the gap locations
+- **Multiple flight details in single emails (connected flights, round trips, multi-city itineraries)**
+
+IMPORTANT: If an email contains multiple flight segments (e.g., outbound and return flights, connected flights, layovers), extract ALL of them as separate entries. Each flight segment should be a separate entry in the JSON array.
+
+Return ONLY a JSON array of travel entries in this format:
+[
+  {
+    "departure_country": "XX",
+    "departure_city": "City Name",
+    "departure_date": "YYYY-MM-DD",
+    "departure_time": "HH:MM",
+    "arrival_country": "XX", 
+    "arrival_city": "City Name",
+    "arrival_date": "YYYY-MM-DD",
+    "arrival_time": "HH:MM",
+    "notes": "Description",
+    "source_file": "filename.eml"
+  }
+]
+
+IMPORTANT COUNTRY CODE REQUIREMENTS:
+- Use ISO 3166-1 alpha-2 country codes (2-letter codes only)
+- Examples: GB (United Kingdom), US (United States), FR (France), DE (Germany)
+- Common mappings: UK → GB, United Kingdom → GB, USA → US, United States → US
+- Do NOT use full country names or 3-letter codes
+
+If no travel information is found, return an empty array [].
+"""
+
+# Email tokens per batch extraction request (on top of the prefix and gaps), and an email cap so
+# the extracted entries still fit the 1500-token reply
+EMAIL_BATCH_TOKEN_BUDGET = 3000
+MAX_EMAILS_PER_BATCH = 12
+BATCH_EMAIL_CONTENT_CHARS = 800
+
+def format_batch_email(email: Dict) -> str:
+    """One email's section of a batch extraction prompt, with its content cut short to keep batches small"""
+    return (f"\n--- EMAIL: {email['file']} ---\n"
+            f"Date: {email['date']}\n"
+            f"Subject: {email['subject']}\n"
+            f"From: {email['sender']}\n"
+            f"Content: {email['content'][:BATCH_EMAIL_CONTENT_CHARS]}...\n")
+
+def batch_emails_by_tokens(emails: List[Dict], budget_tokens: int, max_emails: int) -> List[List[Dict]]:
+    """Split emails, in order, into batches whose prompt sections fit the token budget (an oversized email goes alone)"""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for email in emails:
+        cost = estimate_tokens(format_batch_email(email), 0)
+        if batch and (batch_tokens + cost > budget_tokens or len(batch) >= max_emails):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(email)
+        batch_tokens += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+# Prompt tokens allowed for one period request (instructions plus emails)
+PERIOD_PROMPT_TOKEN_BUDGET = 6000
+EMAIL_SEPARATOR = "\n\n---\n\n"
+
+def pack_email_texts(emails: List[Dict], budget_tokens: int) -> Tuple[List[str], List[str]]:
+    """Email prompt sections and their source files, taken in order until the next one would exceed the token budget"""
+    email_texts = []
+    source_files = []
+    for email in emails:
+        email_text = f"Subject: {email['subject']}\nSender: {email['sender']}\nContent: {email['content']}"
+        cost = estimate_tokens(EMAIL_SEPARATOR + email_text, 0)
+        if cost > budget_tokens:
+            break
+        budget_tokens -= cost
+        email_texts.append(email_text)
+        source_files.append(email['file'])
+    return email_texts, source_files
+
+class RateLimiter:
+    """Token-bucket limiter for requests per minute and tokens per minute"""
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self.last_update = time.monotonic()
+    
+    def _refill(self):
+        """Add back the capacity earned since the last update"""
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.requests_per_minute,
+                                      self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute,
+                                    self.available_tokens + elapsed * self.tokens_per_minute / 60)
+    
+    async def acquire(self, tokens: int):
+        """Wait until there is capacity for one request of the given token cost, then take it"""
+        tokens = min(tokens, self.tokens_per_minute)  # an oversized request waits for a full bucket
+        while True:
+            self._refill()
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return
+            
+            # Sleep until whichever bucket is short should have refilled
+            wait_time = max((1 - self.available_requests) * 60 / self.requests_per_minute,
+                            (tokens - self.available_tokens) * 60 / self.tokens_per_minute)
+            await asyncio.sleep(max(wait_time, 0.01))
 
 class AsyncTravelParser:
-    def __init__(self, csv_file: str, email_dir: str, max_workers: int = None, batch_size: int = 50):
+    def __init__(self, csv_file: Union[str, TextIO], email_dir: str, max_workers: int = None, batch_size: int = 50,
+                 use_llm_cache: bool = True, email_cache_file: str = None):
         self.csv_file = csv_file
         self.email_dir = email_dir
         self.travel_data = []
@@ -50,29 +814,136 @@ class AsyncTravelParser:
         self.found_entries = []
         self.max_workers = max_workers or min(cpu_count(), 12)  # Increased for async
         self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
+        self._openai_semaphore = None
+        self._process_pool = None
+        self.email_cache_file = email_cache_file or EMAIL_CACHE_PATH
+        self._email_cache = None
+        self._email_cache_dirty = False
+        self.llm_cache = LLMCache() if use_llm_cache else None
+        ensure_openai_key()
+    
+    def process_pool(self) -> ProcessPoolExecutor:
+        """Worker processes for CPU-bound email parsing (started on first use)"""
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._process_pool
+    
+    def close_process_pool(self):
+        """Shut down the email parsing workers"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+    
+    async def __aenter__(self) -> 'AsyncTravelParser':
+        """Use the parser in 'async with' for one-off parsing outside run_async()"""
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        """Shut down the email parsing workers and save newly parsed emails"""
+        self.close_process_pool()
+        self.save_email_cache()
+    
+    def email_cache(self) -> Dict:
+        """Parsed emails from previous runs, by absolute file path (loaded on first use)"""
+        if self._email_cache is None:
+            self._email_cache = {}
+            try:
+                with open(self.email_cache_file, 'rb') as f:
+                    stored = json_loads(f.read())
+                # A cache from another parser version is dropped and rebuilt
+                if stored.get('version') == EMAIL_CACHE_VERSION:
+                    self._email_cache = {path: (tuple(stamp), decode_cached_email(result))
+                                         for path, (stamp, result) in stored['emails'].items()}
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠️  Ignoring unreadable email cache {self.email_cache_file}: {e}")
+        return self._email_cache
+    
+    def save_email_cache(self, email_files: List[str] = None):
+        """Write newly parsed emails back to the cache file, dropping files no longer in this email directory"""
+        cache = self.email_cache()
+        if email_files is not None:
+            listed = set(map(os.path.abspath, email_files))
+            email_dir = os.path.join(os.path.abspath(self.email_dir), '')
+            for path in [path for path in cache if path.startswith(email_dir) and path not in listed]:
+                del cache[path]
+                self._email_cache_dirty = True
+        if not self._email_cache_dirty:
+            return
+        temp_file = self.email_cache_file + '.tmp'
+        try:
+            directory = os.path.dirname(self.email_cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            emails = {path: (stamp, encode_cached_email(result)) for path, (stamp, result) in cache.items()}
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': EMAIL_CACHE_VERSION, 'emails': emails}, f, ensure_ascii=False)
+            os.replace(temp_file, self.email_cache_file)
+            self._email_cache_dirty = False
+        except OSError as e:
+            print(f"⚠️  Could not save email cache {self.email_cache_file}: {e}")
+    
+    @asynccontextmanager
+    async def openai_session(self):
+        """Share one pooled aiohttp session across OpenAI requests (the SDK otherwise opens a new one per call)"""
+        if openai.aiosession.get() is not None:
+            yield
+            return
+        # Enough kept-alive connections for every request the semaphore lets through at once; every
+        # request goes to the same API host, so its address is resolved once per run rather than every 10s
+        connector = aiohttp.TCPConnector(limit=self.max_workers, ttl_dns_cache=OPENAI_DNS_CACHE_TTL)
+        session = aiohttp.ClientSession(connector=connector)
+        token = openai.aiosession.set(session)
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
+            await session.close()
+    
+    def openai_semaphore(self) -> asyncio.Semaphore:
+        """Semaphore bounding in-flight OpenAI requests (created inside the running event loop)"""
+        if self._openai_semaphore is None:
+            self._openai_semaphore = asyncio.Semaphore(self.max_workers)
+        return self._openai_semaphore
         
     def load_travel_data(self):
         """Load existing travel data from CSV and sort chronologically"""
         print("Loading existing travel data...")
-        with open(self.csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            self.travel_data = list(reader)
-        
-        # Normalize country codes in all entries
         print("Normalizing country codes to ISO 3166-1 alpha-2 format...")
+        self.travel_data = []
+        append = self.travel_data.append
         normalized_count = 0
-        for entry in self.travel_data:
-            original_departure = entry.get('departure_country', '')
-            original_arrival = entry.get('arrival_country', '')
-            
-            normalized_entry = self.normalize_travel_entry_country_codes(entry)
-            
-            if (normalized_entry.get('departure_country', '') != original_departure or 
-                normalized_entry.get('arrival_country', '') != original_arrival):
-                normalized_count += 1
-            
-            # Update the entry with normalized country codes
-            entry.update(normalized_entry)
+        normalize = _normalize_country_code
+        # Locations, dates and times repeat across a travel log - keep one copy of each distinct value
+        shared_values = {}
+        share = shared_values.setdefault
+        
+        # csv_file is a path, or an already-open text stream (which is read but left open)
+        if hasattr(self.csv_file, 'read'):
+            source = nullcontext(self.csv_file)
+        else:
+            source = open(self.csv_file, 'r', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE)
+        with source as f:
+            # Normalize country codes in the same pass as reading; no second walk over the rows
+            for entry in csv.DictReader(f):
+                changed = False
+                if 'departure_country' in entry:
+                    departure = entry['departure_country']
+                    entry['departure_country'] = normalized = normalize(departure)
+                    changed = normalized != departure
+                if 'arrival_country' in entry:
+                    arrival = entry['arrival_country']
+                    entry['arrival_country'] = normalized = normalize(arrival)
+                    changed = changed or normalized != arrival
+                normalized_count += changed
+                
+                for column in SHARED_VALUE_COLUMNS:
+                    if column in entry:
+                        value = entry[column]
+                        entry[column] = share(value, value)
+                append(entry)
         
         if normalized_count > 0:
             print(f"Normalized country codes in {normalized_count} entries")
@@ -83,28 +954,29 @@ class AsyncTravelParser:
     
     def sort_travel_data_chronologically(self, travel_data):
         """Sort travel data chronologically by departure date and time"""
+        parse_date = parse_iso_date
+        midnight = MIDNIGHT
+        combine = datetime.combine
+        
         def get_sort_key(entry):
             try:
                 # Parse departure date
-                departure_date = datetime.strptime(entry['departure_date'], '%Y-%m-%d')
+                departure_date = parse_date(entry['departure_date'])
                 
                 # Parse departure time if available
                 departure_time = entry.get('departure_time', '00:00')
+                departure_time_obj = midnight
                 if departure_time and departure_time != 'N/A' and departure_time != '':
                     try:
                         time_parts = departure_time.split(':')
                         if len(time_parts) == 2:
                             hour, minute = map(int, time_parts)
-                            departure_time_obj = datetime.strptime(f"{hour:02d}:{minute:02d}", '%H:%M').time()
-                        else:
-                            departure_time_obj = datetime.strptime('00:00', '%H:%M').time()
+                            departure_time_obj = midnight.replace(hour=hour, minute=minute)
                     except:
-                        departure_time_obj = datetime.strptime('00:00', '%H:%M').time()
-                else:
-                    departure_time_obj = datetime.strptime('00:00', '%H:%M').time()
+                        pass
                 
                 # Combine date and time for sorting
-                return datetime.combine(departure_date, departure_time_obj)
+                return combine(departure_date, departure_time_obj)
             except:
                 # If date parsing fails, use a very early date
                 return datetime(1900, 1, 1)
@@ -116,8 +988,8 @@ class AsyncTravelParser:
         negative_gaps = 0
         for i in range(len(sorted_data) - 1):
             try:
-                current_date = datetime.strptime(sorted_data[i]['arrival_date'], '%Y-%m-%d')
-                next_date = datetime.strptime(sorted_data[i + 1]['departure_date'], '%Y-%m-%d')
+                current_date = parse_date(sorted_data[i]['arrival_date'])
+                next_date = parse_date(sorted_data[i + 1]['departure_date'])
                 if (next_date - current_date).days < 0:
                     negative_gaps += 1
             except:
@@ -138,48 +1010,55 @@ class AsyncTravelParser:
         country_gaps = 0
         city_gaps = 0
         
-        for i in range(len(self.travel_data) - 1):
-            current = self.travel_data[i]
-            next_entry = self.travel_data[i + 1]
+        # Compare each entry's arrival city with the next entry's departure city a column at
+        # a time; the lowercased city names are cached, so repeated cities allocate nothing
+        data = self.travel_data
+        gaps = self.gaps
+        extract = self.extract_city_name
+        days_between = self.calculate_days_between
+        arrival_keys = [_city_match_key(entry['arrival_city']) for entry in data[:-1]]
+        departure_keys = [_city_match_key(entry['departure_city']) for entry in data[1:]]
+        gap_mask = map(operator.ne, arrival_keys, departure_keys)
+        
+        # Only build gap records (and display city names) where there's a gap
+        for i in compress(range(len(arrival_keys)), gap_mask):
+            current = data[i]
+            next_entry = data[i + 1]
+            current_arrival = extract(current['arrival_city'])
+            next_departure = extract(next_entry['departure_city'])
             
-            # Extract city names (remove airport codes and country info)
-            current_arrival = self.extract_city_name(current['arrival_city'])
-            next_departure = self.extract_city_name(next_entry['departure_city'])
+            # Determine gap type based on country
+            current_country = current['arrival_country']
+            next_country = next_entry['departure_country']
+            is_country_gap = current_country.lower() != next_country.lower()
             
-            # Check if there's a gap
-            if current_arrival.lower() != next_departure.lower():
-                # Determine gap type based on country
-                current_country = current['arrival_country']
-                next_country = next_entry['departure_country']
-                is_country_gap = current_country.lower() != next_country.lower()
-                
-                gap_type = "COUNTRY" if is_country_gap else "CITY"
-                priority_icon = "🔴" if is_country_gap else "🟡"
-                
-                gap = {
-                    'gap_index': i,
-                    'gap_number': len(self.gaps) + 1,
-                    'current_arrival': current_arrival,
-                    'current_arrival_country': current_country,
-                    'current_arrival_date': current['arrival_date'],
-                    'next_departure': next_departure,
-                    'next_departure_country': next_country,
-                    'next_departure_date': next_entry['departure_date'],
-                    'gap_period': f"{current['arrival_date']} to {next_entry['departure_date']}",
-                    'days_between': self.calculate_days_between(current['arrival_date'], next_entry['departure_date']),
-                    'gap_type': gap_type,
-                    'is_country_gap': is_country_gap
-                }
-                self.gaps.append(gap)
-                
-                if is_country_gap:
-                    country_gaps += 1
-                else:
-                    city_gaps += 1
-                
-                if verbose:
-                    days = gap['days_between']
-                    print(f"{priority_icon} GAP #{gap['gap_number']:2d} ({gap_type}): {current_arrival} ({current_country}) → {next_departure} ({next_country}) [{days} days]")
+            gap_type = "COUNTRY" if is_country_gap else "CITY"
+            priority_icon = "🔴" if is_country_gap else "🟡"
+            
+            gap = {
+                'gap_index': i,
+                'gap_number': len(gaps) + 1,
+                'current_arrival': current_arrival,
+                'current_arrival_country': current_country,
+                'current_arrival_date': current['arrival_date'],
+                'next_departure': next_departure,
+                'next_departure_country': next_country,
+                'next_departure_date': next_entry['departure_date'],
+                'gap_period': f"{current['arrival_date']} to {next_entry['departure_date']}",
+                'days_between': days_between(current['arrival_date'], next_entry['departure_date']),
+                'gap_type': gap_type,
+                'is_country_gap': is_country_gap
+            }
+            gaps.append(gap)
+            
+            if is_country_gap:
+                country_gaps += 1
+            else:
+                city_gaps += 1
+            
+            if verbose:
+                days = gap['days_between']
+                print(f"{priority_icon} GAP #{gap['gap_number']:2d} ({gap_type}): {current_arrival} ({current_country}) → {next_departure} ({next_country}) [{days} days]")
         
         if verbose:
             print(f"\n📊 SUMMARY: Found {len(self.gaps)} gaps in travel itinerary")
@@ -197,93 +1076,28 @@ class AsyncTravelParser:
     def calculate_days_between(self, date1_str, date2_str):
         """Calculate days between two date strings"""
         try:
-            date1 = datetime.strptime(date1_str, '%Y-%m-%d')
-            date2 = datetime.strptime(date2_str, '%Y-%m-%d')
+            date1 = parse_iso_date(date1_str)
+            date2 = parse_iso_date(date2_str)
             return (date2 - date1).days
         except:
             return 0
     
     def extract_city_name(self, city_string: str) -> str:
         """Extract city name from city string, removing airport codes and country info"""
-        # Remove airport codes in parentheses
-        city = re.sub(r'\s*\([^)]*\)', '', city_string)
-        # Remove country info after dash
-        city = city.split(' - ')[0].split(',')[0]
-        return city.strip()
+        return _extract_city_name(city_string)
     
     async def parse_email_async(self, email_file: str) -> Optional[Dict]:
         """Parse email asynchronously from .eml file"""
         try:
-            async with aiofiles.open(email_file, 'r', encoding='utf-8', errors='ignore') as f:
-                content = await f.read()
-                msg = email.message_from_string(content)
-            
-            # Extract headers
-            subject = self.decode_header(msg.get('Subject', ''))
-            sender = self.decode_header(msg.get('From', ''))
-            date_str = msg.get('Date', '')
-            
-            # Parse date
-            email_date = None
-            if date_str:
-                try:
-                    # Parse email date
-                    email_date = datetime.strptime(date_str.split(',')[1].strip()[:11], '%d %b %Y')
-                except:
-                    try:
-                        email_date = datetime.strptime(date_str.split(',')[1].strip()[:11], '%d %b %Y')
-                    except:
-                        pass
-            
-            # Extract content
-            content_text = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        content_text += part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    elif part.get_content_type() == "text/html":
-                        html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        soup = BeautifulSoup(html_content, 'html.parser')
-                        content_text += soup.get_text()
-            else:
-                if msg.get_content_type() == "text/plain":
-                    content_text = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
-                elif msg.get_content_type() == "text/html":
-                    html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    content_text += soup.get_text()
-            
-            return {
-                'file': email_file,
-                'subject': subject,
-                'sender': sender,
-                'date': email_date,
-                'content': content_text.strip()
-            }
-            
+            loop = asyncio.get_event_loop()
+            # Reading, MIME parsing and HTML stripping all happen in a worker process, off the event loop
+            return await loop.run_in_executor(self.process_pool(), parse_email_file, email_file)
         except Exception as e:
             return None
     
     def decode_header(self, header_value: str) -> str:
         """Decode email header value"""
-        if not header_value:
-            return ""
-        
-        decoded_parts = decode_header(header_value)
-        decoded_string = ""
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                if encoding:
-                    try:
-                        decoded_string += part.decode(encoding)
-                    except:
-                        decoded_string += part.decode('utf-8', errors='ignore')
-                else:
-                    decoded_string += part.decode('utf-8', errors='ignore')
-            else:
-                decoded_string += part
-        
-        return decoded_string
+        return decode_email_header(header_value)
     
     def load_travel_keywords(self) -> List[str]:
         """Load travel keywords from file"""
@@ -308,675 +1122,42 @@ class AsyncTravelParser:
         
         return keywords
     
-    def get_gap_location_keywords(self, gaps: List[Dict]) -> List[str]:
+    def get_gap_location_keywords(self, gaps: List[Dict]) -> FrozenSet[str]:
         """Extract location keywords from gaps for enhanced email filtering"""
-        gap_keywords = []
+        gap_keywords = set()
         
         for gap in gaps:
             # Add city names
-            current_city = gap.get('current_arrival', '').lower().strip()
-            next_city = gap.get('next_departure', '').lower().strip()
-            
-            if current_city:
-                gap_keywords.append(current_city)
-            if next_city:
-                gap_keywords.append(next_city)
+            gap_keywords.add(gap.get('current_arrival', '').lower().strip())
+            gap_keywords.add(gap.get('next_departure', '').lower().strip())
             
             # Add country names
             current_country = gap.get('current_arrival_country', '').lower().strip()
             next_country = gap.get('next_departure_country', '').lower().strip()
-            
-            if current_country:
-                gap_keywords.append(current_country)
-            if next_country:
-                gap_keywords.append(next_country)
+            gap_keywords.add(current_country)
+            gap_keywords.add(next_country)
             
             # Add common country name variations
-            country_variations = {
-                'gb': ['united kingdom', 'uk', 'britain', 'england', 'scotland', 'wales'],
-                'us': ['united states', 'usa', 'america'],
-                'th': ['thailand'],
-                'my': ['malaysia'],
-                'sg': ['singapore'],
-                'id': ['indonesia'],
-                'ph': ['philippines'],
-                'vn': ['vietnam'],
-                'kh': ['cambodia'],
-                'la': ['laos'],
-                'mm': ['myanmar', 'burma'],
-                'bn': ['brunei'],
-                'fr': ['france'],
-                'de': ['germany'],
-                'it': ['italy'],
-                'es': ['spain'],
-                'nl': ['netherlands', 'holland'],
-                'be': ['belgium'],
-                'ch': ['switzerland'],
-                'at': ['austria'],
-                'dk': ['denmark'],
-                'se': ['sweden'],
-                'no': ['norway'],
-                'fi': ['finland'],
-                'pl': ['poland'],
-                'cz': ['czech republic', 'czechia'],
-                'hu': ['hungary'],
-                'sk': ['slovakia'],
-                'si': ['slovenia'],
-                'hr': ['croatia'],
-                'rs': ['serbia'],
-                'bg': ['bulgaria'],
-                'ro': ['romania'],
-                'gr': ['greece'],
-                'tr': ['turkey'],
-                'ru': ['russia'],
-                'ua': ['ukraine'],
-                'by': ['belarus'],
-                'lt': ['lithuania'],
-                'lv': ['latvia'],
-                'ee': ['estonia'],
-                'ie': ['ireland'],
-                'pt': ['portugal'],
-                'lu': ['luxembourg'],
-                'mt': ['malta'],
-                'cy': ['cyprus'],
-                'is': ['iceland'],
-                'li': ['liechtenstein'],
-                'mc': ['monaco'],
-                'ad': ['andorra'],
-                'sm': ['san marino'],
-                'va': ['vatican'],
-                'jp': ['japan'],
-                'kr': ['south korea', 'korea'],
-                'cn': ['china'],
-                'tw': ['taiwan'],
-                'hk': ['hong kong'],
-                'mo': ['macau'],
-                'in': ['india'],
-                'pk': ['pakistan'],
-                'bd': ['bangladesh'],
-                'lk': ['sri lanka'],
-                'mv': ['maldives'],
-                'np': ['nepal'],
-                'bt': ['bhutan'],
-                'af': ['afghanistan'],
-                'ir': ['iran'],
-                'iq': ['iraq'],
-                'sy': ['syria'],
-                'lb': ['lebanon'],
-                'jo': ['jordan'],
-                'il': ['israel'],
-                'ps': ['palestine'],
-                'sa': ['saudi arabia'],
-                'ae': ['united arab emirates', 'uae'],
-                'qa': ['qatar'],
-                'kw': ['kuwait'],
-                'bh': ['bahrain'],
-                'om': ['oman'],
-                'ye': ['yemen'],
-                'eg': ['egypt'],
-                'ly': ['libya'],
-                'tn': ['tunisia'],
-                'dz': ['algeria'],
-                'ma': ['morocco'],
-                'sd': ['sudan'],
-                'ss': ['south sudan'],
-                'et': ['ethiopia'],
-                'er': ['eritrea'],
-                'dj': ['djibouti'],
-                'so': ['somalia'],
-                'ke': ['kenya'],
-                'ug': ['uganda'],
-                'tz': ['tanzania'],
-                'rw': ['rwanda'],
-                'bi': ['burundi'],
-                'mw': ['malawi'],
-                'zm': ['zambia'],
-                'zw': ['zimbabwe'],
-                'bw': ['botswana'],
-                'na': ['namibia'],
-                'za': ['south africa'],
-                'sz': ['swaziland', 'eswatini'],
-                'ls': ['lesotho'],
-                'mg': ['madagascar'],
-                'mu': ['mauritius'],
-                'sc': ['seychelles'],
-                'km': ['comoros'],
-                'mz': ['mozambique'],
-                'ao': ['angola'],
-                'cd': ['congo', 'democratic republic of congo'],
-                'cg': ['congo', 'republic of congo'],
-                'cf': ['central african republic'],
-                'td': ['chad'],
-                'cm': ['cameroon'],
-                'gq': ['equatorial guinea'],
-                'ga': ['gabon'],
-                'st': ['sao tome and principe'],
-                'gh': ['ghana'],
-                'tg': ['togo'],
-                'bj': ['benin'],
-                'ne': ['niger'],
-                'bf': ['burkina faso'],
-                'ml': ['mali'],
-                'sn': ['senegal'],
-                'gm': ['gambia'],
-                'gw': ['guinea-bissau'],
-                'gn': ['guinea'],
-                'sl': ['sierra leone'],
-                'lr': ['liberia'],
-                'ci': ['ivory coast', 'cote d\'ivoire'],
-                'gh': ['ghana'],
-                'tg': ['togo'],
-                'bj': ['benin'],
-                'ne': ['niger'],
-                'bf': ['burkina faso'],
-                'ml': ['mali'],
-                'sn': ['senegal'],
-                'gm': ['gambia'],
-                'gw': ['guinea-bissau'],
-                'gn': ['guinea'],
-                'sl': ['sierra leone'],
-                'lr': ['liberia'],
-                'ci': ['ivory coast', 'cote d\'ivoire'],
-                'ca': ['canada'],
-                'mx': ['mexico'],
-                'gt': ['guatemala'],
-                'bz': ['belize'],
-                'sv': ['el salvador'],
-                'hn': ['honduras'],
-                'ni': ['nicaragua'],
-                'cr': ['costa rica'],
-                'pa': ['panama'],
-                'cu': ['cuba'],
-                'jm': ['jamaica'],
-                'ht': ['haiti'],
-                'do': ['dominican republic'],
-                'pr': ['puerto rico'],
-                'tt': ['trinidad and tobago'],
-                'bb': ['barbados'],
-                'ag': ['antigua and barbuda'],
-                'dm': ['dominica'],
-                'gd': ['grenada'],
-                'kn': ['saint kitts and nevis'],
-                'lc': ['saint lucia'],
-                'vc': ['saint vincent and the grenadines'],
-                'bs': ['bahamas'],
-                'ar': ['argentina'],
-                'bo': ['bolivia'],
-                'br': ['brazil'],
-                'cl': ['chile'],
-                'co': ['colombia'],
-                'ec': ['ecuador'],
-                'fk': ['falkland islands'],
-                'gf': ['french guiana'],
-                'gy': ['guyana'],
-                'py': ['paraguay'],
-                'pe': ['peru'],
-                'sr': ['suriname'],
-                'uy': ['uruguay'],
-                've': ['venezuela'],
-                'au': ['australia'],
-                'nz': ['new zealand'],
-                'fj': ['fiji'],
-                'pg': ['papua new guinea'],
-                'sb': ['solomon islands'],
-                'vu': ['vanuatu'],
-                'nc': ['new caledonia'],
-                'pf': ['french polynesia'],
-                'ws': ['samoa'],
-                'to': ['tonga'],
-                'ki': ['kiribati'],
-                'tv': ['tuvalu'],
-                'nr': ['nauru'],
-                'pw': ['palau'],
-                'fm': ['micronesia'],
-                'mh': ['marshall islands'],
-                'as': ['american samoa'],
-                'gu': ['guam'],
-                'mp': ['northern mariana islands'],
-                'vi': ['us virgin islands'],
-                'vg': ['british virgin islands'],
-                'ai': ['anguilla'],
-                'aw': ['aruba'],
-                'bq': ['bonaire'],
-                'cw': ['curacao'],
-                'sx': ['sint maarten'],
-                'bl': ['saint barthelemy'],
-                'mf': ['saint martin'],
-                'gp': ['guadeloupe'],
-                'mq': ['martinique'],
-                're': ['reunion'],
-                'yt': ['mayotte'],
-                'sh': ['saint helena'],
-                'ac': ['ascension island'],
-                'ta': ['tristan da cunha'],
-                'gs': ['south georgia and the south sandwich islands'],
-                'hm': ['heard island and mcdonald islands'],
-                'tf': ['french southern territories'],
-                'aq': ['antarctica'],
-                'bv': ['bouvet island'],
-                'sj': ['svalbard and jan mayen'],
-                'no': ['norway'],
-                'gl': ['greenland'],
-                'fo': ['faroe islands'],
-                'ax': ['aland islands'],
-                'je': ['jersey'],
-                'gg': ['guernsey'],
-                'im': ['isle of man'],
-                'gi': ['gibraltar'],
-                'ad': ['andorra'],
-                'sm': ['san marino'],
-                'va': ['vatican'],
-                'li': ['liechtenstein'],
-                'mc': ['monaco'],
-                'mt': ['malta'],
-                'cy': ['cyprus'],
-                'tr': ['turkey'],
-                'ru': ['russia'],
-                'ua': ['ukraine'],
-                'by': ['belarus'],
-                'md': ['moldova'],
-                'ro': ['romania'],
-                'bg': ['bulgaria'],
-                'gr': ['greece'],
-                'al': ['albania'],
-                'me': ['montenegro'],
-                'rs': ['serbia'],
-                'ba': ['bosnia and herzegovina'],
-                'hr': ['croatia'],
-                'si': ['slovenia'],
-                'sk': ['slovakia'],
-                'cz': ['czech republic', 'czechia'],
-                'hu': ['hungary'],
-                'at': ['austria'],
-                'ch': ['switzerland'],
-                'li': ['liechtenstein'],
-                'de': ['germany'],
-                'lu': ['luxembourg'],
-                'be': ['belgium'],
-                'nl': ['netherlands', 'holland'],
-                'dk': ['denmark'],
-                'se': ['sweden'],
-                'no': ['norway'],
-                'fi': ['finland'],
-                'is': ['iceland'],
-                'ie': ['ireland'],
-                'gb': ['united kingdom', 'uk', 'britain', 'england', 'scotland', 'wales'],
-                'fr': ['france'],
-                'es': ['spain'],
-                'pt': ['portugal'],
-                'it': ['italy'],
-                'mt': ['malta'],
-                'cy': ['cyprus'],
-                'gr': ['greece'],
-                'tr': ['turkey'],
-                'ru': ['russia'],
-                'ua': ['ukraine'],
-                'by': ['belarus'],
-                'md': ['moldova'],
-                'ro': ['romania'],
-                'bg': ['bulgaria'],
-                'al': ['albania'],
-                'me': ['montenegro'],
-                'rs': ['serbia'],
-                'ba': ['bosnia and herzegovina'],
-                'hr': ['croatia'],
-                'si': ['slovenia'],
-                'sk': ['slovakia'],
-                'cz': ['czech republic', 'czechia'],
-                'hu': ['hungary'],
-                'at': ['austria'],
-                'ch': ['switzerland'],
-                'li': ['liechtenstein'],
-                'de': ['germany'],
-                'lu': ['luxembourg'],
-                'be': ['belgium'],
-                'nl': ['netherlands', 'holland'],
-                'dk': ['denmark'],
-                'se': ['sweden'],
-                'no': ['norway'],
-                'fi': ['finland'],
-                'is': ['iceland'],
-                'ie': ['ireland'],
-                'gb': ['united kingdom', 'uk', 'britain', 'england', 'scotland', 'wales'],
-                'fr': ['france'],
-                'es': ['spain'],
-                'pt': ['portugal'],
-                'it': ['italy']
-            }
-            
-            # Add country variations
-            if current_country in country_variations:
-                gap_keywords.extend(country_variations[current_country])
-            if next_country in country_variations:
-                gap_keywords.extend(country_variations[next_country])
+            gap_keywords.update(COUNTRY_VARIATIONS.get(current_country, ()))
+            gap_keywords.update(COUNTRY_VARIATIONS.get(next_country, ()))
         
-        # Remove duplicates and empty strings
-        gap_keywords = list(set([kw for kw in gap_keywords if kw.strip()]))
+        # Remove empty strings
+        gap_keywords.discard('')
         
-        return gap_keywords
+        return frozenset(gap_keywords)
     
     def normalize_country_code(self, country_code: str) -> str:
         """Normalize country codes to ISO 3166-1 alpha-2 format"""
-        if not country_code or country_code.strip() == '':
-            return 'Unknown'
-        
-        country_code = country_code.strip().upper()
-        
-        # Common country code mappings to ISO 3166-1 alpha-2
-        country_mappings = {
-            'UK': 'GB',  # United Kingdom
-            'UNITED KINGDOM': 'GB',
-            'BRITAIN': 'GB',
-            'ENGLAND': 'GB',
-            'SCOTLAND': 'GB',
-            'WALES': 'GB',
-            'USA': 'US',  # United States
-            'UNITED STATES': 'US',
-            'AMERICA': 'US',
-            'USA': 'US',
-            'DEUTSCHLAND': 'DE',  # Germany
-            'ALLEMAGNE': 'DE',
-            'FRANCE': 'FR',
-            'ESPANA': 'ES',  # Spain
-            'SPAIN': 'ES',
-            'ITALIA': 'IT',  # Italy
-            'ITALY': 'IT',
-            'NEDERLAND': 'NL',  # Netherlands
-            'HOLLAND': 'NL',
-            'NEDERLANDEN': 'NL',
-            'BELGIE': 'BE',  # Belgium
-            'BELGIUM': 'BE',
-            'SCHWEIZ': 'CH',  # Switzerland
-            'SUISSE': 'CH',
-            'SVIZZERA': 'CH',
-            'OSTERREICH': 'AT',  # Austria
-            'AUSTRIA': 'AT',
-            'DANMARK': 'DK',  # Denmark
-            'DENMARK': 'DK',
-            'SVERIGE': 'SE',  # Sweden
-            'SWEDEN': 'SE',
-            'NORGE': 'NO',  # Norway
-            'NORWAY': 'NO',
-            'SUOMI': 'FI',  # Finland
-            'FINLAND': 'FI',
-            'ISLAND': 'IS',  # Iceland
-            'ICELAND': 'IS',
-            'EIRE': 'IE',  # Ireland
-            'IRELAND': 'IE',
-            'POLSKA': 'PL',  # Poland
-            'POLAND': 'PL',
-            'CESKA REPUBLIKA': 'CZ',  # Czech Republic
-            'CZECH REPUBLIC': 'CZ',
-            'CZECHIA': 'CZ',
-            'MAGYARORSZAG': 'HU',  # Hungary
-            'HUNGARY': 'HU',
-            'SLOVENSKO': 'SK',  # Slovakia
-            'SLOVAKIA': 'SK',
-            'SLOVENIJA': 'SI',  # Slovenia
-            'SLOVENIA': 'SI',
-            'HRVATSKA': 'HR',  # Croatia
-            'CROATIA': 'HR',
-            'SRBIJA': 'RS',  # Serbia
-            'SERBIA': 'RS',
-            'BULGARIA': 'BG',
-            'ROMANIA': 'RO',
-            'ELLADA': 'GR',  # Greece
-            'GREECE': 'GR',
-            'TURKIYE': 'TR',  # Turkey
-            'TURKEY': 'TR',
-            'ROSSIYA': 'RU',  # Russia
-            'RUSSIA': 'RU',
-            'UKRAINA': 'UA',  # Ukraine
-            'UKRAINE': 'UA',
-            'BELARUS': 'BY',
-            'LITHUANIA': 'LT',
-            'LATVIA': 'LV',
-            'ESTONIA': 'EE',
-            'PORTUGAL': 'PT',
-            'LUXEMBOURG': 'LU',
-            'MALTA': 'MT',
-            'CYPRUS': 'CY',
-            'LIECHTENSTEIN': 'LI',
-            'MONACO': 'MC',
-            'ANDORRA': 'AD',
-            'SAN MARINO': 'SM',
-            'VATICAN': 'VA',
-            'JAPAN': 'JP',
-            'NIPPON': 'JP',
-            'KOREA': 'KR',
-            'SOUTH KOREA': 'KR',
-            'CHINA': 'CN',
-            'TAIWAN': 'TW',
-            'HONG KONG': 'HK',
-            'MACAU': 'MO',
-            'INDIA': 'IN',
-            'PAKISTAN': 'PK',
-            'BANGLADESH': 'BD',
-            'SRI LANKA': 'LK',
-            'MALDIVES': 'MV',
-            'NEPAL': 'NP',
-            'BHUTAN': 'BT',
-            'AFGHANISTAN': 'AF',
-            'IRAN': 'IR',
-            'IRAQ': 'IQ',
-            'SYRIA': 'SY',
-            'LEBANON': 'LB',
-            'JORDAN': 'JO',
-            'ISRAEL': 'IL',
-            'PALESTINE': 'PS',
-            'SAUDI ARABIA': 'SA',
-            'UAE': 'AE',
-            'UNITED ARAB EMIRATES': 'AE',
-            'QATAR': 'QA',
-            'KUWAIT': 'KW',
-            'BAHRAIN': 'BH',
-            'OMAN': 'OM',
-            'YEMEN': 'YE',
-            'EGYPT': 'EG',
-            'LIBYA': 'LY',
-            'TUNISIA': 'TN',
-            'ALGERIA': 'DZ',
-            'MOROCCO': 'MA',
-            'SUDAN': 'SD',
-            'SOUTH SUDAN': 'SS',
-            'ETHIOPIA': 'ET',
-            'ERITREA': 'ER',
-            'DJIBOUTI': 'DJ',
-            'SOMALIA': 'SO',
-            'KENYA': 'KE',
-            'UGANDA': 'UG',
-            'TANZANIA': 'TZ',
-            'RWANDA': 'RW',
-            'BURUNDI': 'BI',
-            'MALAWI': 'MW',
-            'ZAMBIA': 'ZM',
-            'ZIMBABWE': 'ZW',
-            'BOTSWANA': 'BW',
-            'NAMIBIA': 'NA',
-            'SOUTH AFRICA': 'ZA',
-            'ESWATINI': 'SZ',
-            'LESOTHO': 'LS',
-            'MADAGASCAR': 'MG',
-            'MAURITIUS': 'MU',
-            'SEYCHELLES': 'SC',
-            'COMOROS': 'KM',
-            'MOZAMBIQUE': 'MZ',
-            'ANGOLA': 'AO',
-            'CONGO': 'CD',
-            'DEMOCRATIC REPUBLIC OF CONGO': 'CD',
-            'REPUBLIC OF CONGO': 'CG',
-            'CENTRAL AFRICAN REPUBLIC': 'CF',
-            'CHAD': 'TD',
-            'CAMEROON': 'CM',
-            'EQUATORIAL GUINEA': 'GQ',
-            'GABON': 'GA',
-            'SAO TOME AND PRINCIPE': 'ST',
-            'GHANA': 'GH',
-            'TOGO': 'TG',
-            'BENIN': 'BJ',
-            'NIGER': 'NE',
-            'BURKINA FASO': 'BF',
-            'MALI': 'ML',
-            'SENEGAL': 'SN',
-            'GAMBIA': 'GM',
-            'GUINEA-BISSAU': 'GW',
-            'GUINEA': 'GN',
-            'SIERRA LEONE': 'SL',
-            'LIBERIA': 'LR',
-            'IVORY COAST': 'CI',
-            'COTE D\'IVOIRE': 'CI',
-            'CANADA': 'CA',
-            'MEXICO': 'MX',
-            'GUATEMALA': 'GT',
-            'BELIZE': 'BZ',
-            'EL SALVADOR': 'SV',
-            'HONDURAS': 'HN',
-            'NICARAGUA': 'NI',
-            'COSTA RICA': 'CR',
-            'PANAMA': 'PA',
-            'CUBA': 'CU',
-            'JAMAICA': 'JM',
-            'HAITI': 'HT',
-            'DOMINICAN REPUBLIC': 'DO',
-            'PUERTO RICO': 'PR',
-            'TRINIDAD AND TOBAGO': 'TT',
-            'BARBADOS': 'BB',
-            'ANTIGUA AND BARBUDA': 'AG',
-            'DOMINICA': 'DM',
-            'GRENADA': 'GD',
-            'SAINT KITTS AND NEVIS': 'KN',
-            'SAINT LUCIA': 'LC',
-            'SAINT VINCENT AND THE GRENADINES': 'VC',
-            'BAHAMAS': 'BS',
-            'ARGENTINA': 'AR',
-            'BOLIVIA': 'BO',
-            'BRAZIL': 'BR',
-            'CHILE': 'CL',
-            'COLOMBIA': 'CO',
-            'ECUADOR': 'EC',
-            'FALKLAND ISLANDS': 'FK',
-            'FRENCH GUIANA': 'GF',
-            'GUYANA': 'GY',
-            'PARAGUAY': 'PY',
-            'PERU': 'PE',
-            'SURINAME': 'SR',
-            'URUGUAY': 'UY',
-            'VENEZUELA': 'VE',
-            'AUSTRALIA': 'AU',
-            'NEW ZEALAND': 'NZ',
-            'FIJI': 'FJ',
-            'PAPUA NEW GUINEA': 'PG',
-            'SOLOMON ISLANDS': 'SB',
-            'VANUATU': 'VU',
-            'NEW CALEDONIA': 'NC',
-            'FRENCH POLYNESIA': 'PF',
-            'SAMOA': 'WS',
-            'TONGA': 'TO',
-            'KIRIBATI': 'KI',
-            'TUVALU': 'TV',
-            'NAURU': 'NR',
-            'PALAU': 'PW',
-            'MICRONESIA': 'FM',
-            'MARSHALL ISLANDS': 'MH',
-            'AMERICAN SAMOA': 'AS',
-            'GUAM': 'GU',
-            'NORTHERN MARIANA ISLANDS': 'MP',
-            'US VIRGIN ISLANDS': 'VI',
-            'BRITISH VIRGIN ISLANDS': 'VG',
-            'ANGUILLA': 'AI',
-            'ARUBA': 'AW',
-            'BONAIRE': 'BQ',
-            'CURACAO': 'CW',
-            'SINT MAARTEN': 'SX',
-            'SAINT BARTHELEMY': 'BL',
-            'SAINT MARTIN': 'MF',
-            'GUADELOUPE': 'GP',
-            'MARTINIQUE': 'MQ',
-            'REUNION': 'RE',
-            'MAYOTTE': 'YT',
-            'SAINT HELENA': 'SH',
-            'ASCENSION ISLAND': 'AC',
-            'TRISTAN DA CUNHA': 'TA',
-            'SOUTH GEORGIA AND THE SOUTH SANDWICH ISLANDS': 'GS',
-            'HEARD ISLAND AND MCDONALD ISLANDS': 'HM',
-            'FRENCH SOUTHERN TERRITORIES': 'TF',
-            'ANTARCTICA': 'AQ',
-            'BOUVET ISLAND': 'BV',
-            'SVALBARD AND JAN MAYEN': 'SJ',
-            'GREENLAND': 'GL',
-            'FAROE ISLANDS': 'FO',
-            'ALAND ISLANDS': 'AX',
-            'JERSEY': 'JE',
-            'GUERNSEY': 'GG',
-            'ISLE OF MAN': 'IM',
-            'GIBRALTAR': 'GI',
-            'ANDORRA': 'AD',
-            'SAN MARINO': 'SM',
-            'VATICAN': 'VA',
-            'LIECHTENSTEIN': 'LI',
-            'MONACO': 'MC',
-            'MALTA': 'MT',
-            'CYPRUS': 'CY',
-            'TURKEY': 'TR',
-            'RUSSIA': 'RU',
-            'UKRAINE': 'UA',
-            'BELARUS': 'BY',
-            'MOLDOVA': 'MD',
-            'ROMANIA': 'RO',
-            'BULGARIA': 'BG',
-            'ALBANIA': 'AL',
-            'MONTENEGRO': 'ME',
-            'SERBIA': 'RS',
-            'BOSNIA AND HERZEGOVINA': 'BA',
-            'CROATIA': 'HR',
-            'SLOVENIA': 'SI',
-            'SLOVAKIA': 'SK',
-            'CZECH REPUBLIC': 'CZ',
-            'CZECHIA': 'CZ',
-            'HUNGARY': 'HU',
-            'AUSTRIA': 'AT',
-            'SWITZERLAND': 'CH',
-            'LIECHTENSTEIN': 'LI',
-            'GERMANY': 'DE',
-            'LUXEMBOURG': 'LU',
-            'BELGIUM': 'BE',
-            'NETHERLANDS': 'NL',
-            'DENMARK': 'DK',
-            'SWEDEN': 'SE',
-            'NORWAY': 'NO',
-            'FINLAND': 'FI',
-            'ICELAND': 'IS',
-            'IRELAND': 'IE',
-            'UNITED KINGDOM': 'GB',
-            'FRANCE': 'FR',
-            'SPAIN': 'ES',
-            'PORTUGAL': 'PT',
-            'ITALY': 'IT'
-        }
-        
-        # Check mappings first (including common 2-letter variations)
-        if country_code in country_mappings:
-            return country_mappings[country_code]
-        
-        # If no mapping found, check if it's already a valid ISO code (2 letters)
-        if len(country_code) == 2 and country_code.isalpha():
-            return country_code
-        
-        # If no mapping found and not 2-letter, return as-is
-        return country_code
+        return _normalize_country_code(country_code)
     
     def normalize_travel_entry_country_codes(self, entry: Dict) -> Dict:
-        """Normalize country codes in a travel entry"""
-        normalized_entry = entry.copy()
-        
+        """Normalize country codes in a travel entry (in place; the entry is returned)"""
         # Normalize departure and arrival country codes
-        if 'departure_country' in normalized_entry:
-            normalized_entry['departure_country'] = self.normalize_country_code(normalized_entry['departure_country'])
+        for field in ('departure_country', 'arrival_country'):
+            if field in entry:
+                entry[field] = _normalize_country_code(entry[field])
         
-        if 'arrival_country' in normalized_entry:
-            normalized_entry['arrival_country'] = self.normalize_country_code(normalized_entry['arrival_country'])
-        
-        return normalized_entry
+        return entry
 
     async def search_travel_emails_async(self) -> List[Dict]:
         """Search for travel-related emails using async processing with comprehensive keywords and gap location filtering"""
@@ -987,17 +1168,19 @@ class AsyncTravelParser:
         travel_keywords = self.load_travel_keywords()
         
         # Add gap location keywords for enhanced filtering
-        gap_keywords = []
+        gap_keywords = frozenset()
         if hasattr(self, 'gaps') and self.gaps:
             gap_keywords = self.get_gap_location_keywords(self.gaps)
             print(f"Added {len(gap_keywords)} gap location keywords for enhanced filtering")
         
         # Combine all keywords
-        all_keywords = travel_keywords + gap_keywords
+        all_keywords = [*travel_keywords, *gap_keywords]
         print(f"Loaded {len(travel_keywords)} travel keywords + {len(gap_keywords)} gap location keywords = {len(all_keywords)} total keywords")
+        # One pass per field instead of one substring scan per keyword
+        keyword_search = compile_keyword_pattern(all_keywords).search
         
         # Get all email files
-        email_files = glob.glob(os.path.join(self.email_dir, "*.eml"))
+        email_files = list_email_files(self.email_dir)
         print(f"Found {len(email_files)} email files to process")
         
         # Process emails in batches asynchronously
@@ -1008,8 +1191,12 @@ class AsyncTravelParser:
         # Create semaphore to limit concurrent operations
         semaphore = asyncio.Semaphore(self.max_workers)
         
+        # Bodies already seen this search; forwarded or re-sent copies are skipped before the keyword scan
+        seen_bodies = set()
+        duplicate_count = 0
+        
         async def process_email_batch(batch_files):
-            nonlocal keyword_matches
+            nonlocal keyword_matches, duplicate_count
             batch_start = time.time()
             async with semaphore:
                 tasks = [self.parse_email_direct_async(file) for file in batch_files]
@@ -1022,14 +1209,20 @@ class AsyncTravelParser:
                     if not result:
                         continue
                     
-                    subject = result['subject'].lower()
-                    sender = result['sender'].lower()
-                    content = result['content'].lower()
+                    if result['content']:
+                        digest = email_body_digest(result['content'])
+                        if digest in seen_bodies:
+                            duplicate_count += 1
+                            continue
+                        seen_bodies.add(digest)
                     
-                    # Check if email might contain travel info using all keywords
-                    if any(keyword in subject for keyword in all_keywords) or \
-                       any(keyword in sender for keyword in all_keywords) or \
-                       any(keyword in content for keyword in all_keywords):
+                    # Check if email might contain travel info using all keywords; each field
+                    # is only lowercased if the fields before it didn't match
+                    if keyword_search(result['subject'].lower()) or \
+                       keyword_search(result['sender'].lower()) or \
+                       keyword_search(result['content'].lower()):
+                        # The whole body has been screened and de-duplicated; only the start is sent to the AI
+                        result['content'] = result['content'][:MAX_EMAIL_CHARS].strip()
                         batch_travel_emails.append(result)
                         keyword_matches += 1
                 
@@ -1037,29 +1230,34 @@ class AsyncTravelParser:
                 print(f"  Batch processed in {batch_time:.2f}s, found {len(batch_travel_emails)} travel emails")
                 return batch_travel_emails
         
-        # Process files in batches
-        for i in range(0, len(email_files), self.batch_size):
-            batch_start = time.time()
-            batch_files = email_files[i:i + self.batch_size]
-            batch_results = await process_email_batch(batch_files)
-            travel_emails.extend(batch_results)
-            
-            processed_count += len(batch_files)
-            batch_time = time.time() - batch_start
-            
-            if processed_count % 1000 == 0:
-                elapsed = time.time() - start_time
-                rate = processed_count / elapsed if elapsed > 0 else 0
-                print(f"Processed {processed_count}/{len(email_files)} emails... ({rate:.1f} emails/sec)")
-            
-            # Increased limit for comprehensive filtering
-            if len(travel_emails) >= 1000:  # Increased from 300
-                print(f"Found {len(travel_emails)} travel emails, stopping search...")
-                break
+        # Process files in batches; the pool is shut down and parsed emails saved even if a batch fails
+        try:
+            for i in range(0, len(email_files), self.batch_size):
+                batch_start = time.time()
+                batch_files = email_files[i:i + self.batch_size]
+                batch_results = await process_email_batch(batch_files)
+                travel_emails.extend(batch_results)
+                
+                processed_count += len(batch_files)
+                batch_time = time.time() - batch_start
+                
+                if processed_count % 1000 == 0:
+                    elapsed = time.time() - start_time
+                    rate = processed_count / elapsed if elapsed > 0 else 0
+                    print(f"Processed {processed_count}/{len(email_files)} emails... ({rate:.1f} emails/sec)")
+                
+                # Increased limit for comprehensive filtering
+                if len(travel_emails) >= 1000:  # Increased from 300
+                    print(f"Found {len(travel_emails)} travel emails, stopping search...")
+                    break
+        finally:
+            self.close_process_pool()
+            self.save_email_cache(email_files)
         
         total_time = time.time() - start_time
         print(f"✅ Email filtering completed in {total_time:.2f}s")
         print(f"   • Processed: {processed_count} emails")
+        print(f"   • Duplicate bodies skipped: {duplicate_count}")
         print(f"   • Keyword matches: {keyword_matches}")
         print(f"   • Travel emails found: {len(travel_emails)}")
         print(f"   • Filter efficiency: {len(travel_emails)/processed_count*100:.1f}% of emails were travel-related")
@@ -1067,57 +1265,25 @@ class AsyncTravelParser:
         return travel_emails
     
     async def parse_email_direct_async(self, email_file: str) -> Optional[Dict]:
-        """Parse email directly from .eml file without metadata (async version)"""
+        """Parse email directly from .eml file without metadata (async version), reusing cached results"""
         try:
-            async with aiofiles.open(email_file, 'r', encoding='utf-8', errors='ignore') as f:
-                content = await f.read()
-                msg = email.message_from_string(content)
-            
-            # Extract headers
-            subject = self.decode_header(msg.get('Subject', ''))
-            sender = self.decode_header(msg.get('From', ''))
-            date_str = msg.get('Date', '')
-            
-            # Parse date
-            email_date = None
-            if date_str:
-                try:
-                    # Parse email date
-                    email_date = datetime.strptime(date_str.split(',')[1].strip()[:11], '%d %b %Y')
-                except:
-                    try:
-                        email_date = datetime.strptime(date_str.split(',')[1].strip()[:11], '%d %b %Y')
-                    except:
-                        pass
-            
-            # Extract content
-            content_text = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        content_text += part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    elif part.get_content_type() == "text/html":
-                        html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        soup = BeautifulSoup(html_content, 'html.parser')
-                        content_text += soup.get_text()
-            else:
-                if msg.get_content_type() == "text/plain":
-                    content_text = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
-                elif msg.get_content_type() == "text/html":
-                    html_content = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    content_text += soup.get_text()
-            
-            return {
-                'file': email_file,
-                'subject': subject,
-                'sender': sender,
-                'date': email_date,
-                'content': content_text.strip()
-            }
-            
-        except Exception as e:
-            return None
+            st = os.stat(email_file)
+        except OSError:
+            return await self.parse_email_async(email_file)
+        
+        # An unchanged file (same mtime and size) reuses its previous parse, whichever path it was reached by
+        cache = self.email_cache()
+        key = os.path.abspath(email_file)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            result = cached[1]
+            return dict(result, file=email_file) if result is not None else None
+        
+        result = await self.parse_email_async(email_file)
+        cache[key] = (stamp, dict(result) if result is not None else None)
+        self._email_cache_dirty = True
+        return result
     
     async def extract_travel_info_with_ai_async(self, emails: List[Dict]) -> List[Dict]:
         """Use AI to extract travel information from emails - process each email only once"""
@@ -1126,8 +1292,9 @@ class AsyncTravelParser:
         
         print(f"Using AI to extract travel info from {len(emails)} emails (processing each email only once)...")
         
-        # Process all emails once with AI to extract all travel entries
-        all_travel_entries = await self.analyze_all_emails_with_ai_async(emails)
+        # Process all emails once with AI to extract all travel entries, reusing connections between requests
+        async with self.openai_session():
+            all_travel_entries = await self.analyze_all_emails_with_ai_async(emails)
         
         # Now match extracted entries to gaps
         gap_filling_entries = self.match_entries_to_gaps(all_travel_entries)
@@ -1139,35 +1306,38 @@ class AsyncTravelParser:
         start_time = time.time()
         all_travel_entries = []
         
-        # Process emails in smaller batches to avoid context length limits
-        batch_size = 8  # Reduced from 20 to prevent context overflow
-        total_batches = (len(emails) + batch_size - 1) // batch_size
+        # Pack emails into batches by prompt size, so the shared instructions are sent as few times as possible
+        batches = batch_emails_by_tokens(emails, EMAIL_BATCH_TOKEN_BUDGET, MAX_EMAILS_PER_BATCH)
+        total_batches = len(batches)
         
         print(f"🤖 Starting AI analysis of {len(emails)} emails in {total_batches} batches...")
         
-        for i in range(0, len(emails), batch_size):
+        # Create context for AI about all gaps (the same for every batch)
+        gaps_context = self.create_gaps_context()
+        completed_batches = 0
+        
+        async def run_batch(batch_num: int, batch_emails: List[Dict]) -> List[Dict]:
+            nonlocal completed_batches
             batch_start = time.time()
-            batch_emails = emails[i:i + batch_size]
-            batch_num = i // batch_size + 1
-            
-            # Create context for AI about all gaps
-            gaps_context = self.create_gaps_context()
             
             # Send batch to AI
             entries = await self.analyze_email_batch_with_ai_async(batch_emails, gaps_context)
-            all_travel_entries.extend(entries)
             
+            completed_batches += 1
             batch_time = time.time() - batch_start
             elapsed = time.time() - start_time
-            avg_time_per_batch = elapsed / batch_num
-            remaining_batches = total_batches - batch_num
-            eta = remaining_batches * avg_time_per_batch
+            eta = (total_batches - completed_batches) * elapsed / completed_batches
             
             print(f"  Batch {batch_num}/{total_batches} completed in {batch_time:.2f}s (ETA: {eta:.1f}s) - Found {len(entries)} entries")
-            
-            # Add delay between batches to respect rate limits
-            if batch_num < total_batches:  # Don't delay after the last batch
-                await asyncio.sleep(1.0)  # 1 second delay between batches
+            return entries
+        
+        # Send all batches concurrently - the OpenAI semaphore and rate limiter pace the requests
+        batch_results = await asyncio.gather(*[
+            run_batch(batch_num, batch_emails)
+            for batch_num, batch_emails in enumerate(batches, 1)
+        ])
+        for entries in batch_results:
+            all_travel_entries.extend(entries)
         
         total_time = time.time() - start_time
         print(f"✅ AI analysis completed in {total_time:.2f}s")
@@ -1181,7 +1351,8 @@ class AsyncTravelParser:
     def create_gaps_context(self) -> str:
         """Create context string about all gaps for AI analysis"""
         gaps_info = []
-        for i, gap in enumerate(self.gaps, 1):
+        # In itinerary order, so the same gaps always render the same prompt prefix
+        for i, gap in enumerate(sorted(self.gaps, key=lambda gap: gap.get('gap_index', 0)), 1):
             gap_type = "COUNTRY" if gap['is_country_gap'] else "CITY"
             priority = "🔴" if gap['is_country_gap'] else "🟡"
             gap_days = gap.get('gap_days', gap.get('days', 'Unknown'))
@@ -1189,36 +1360,73 @@ class AsyncTravelParser:
         
         return "GAPS TO FILL:\n" + "\n".join(gaps_info)
     
-    async def call_openai_with_retry(self, prompt: str, max_retries: int = 3) -> any:
+    async def call_openai_with_retry(self, prompt: str, max_retries: int = 3,
+                                     parse: Callable[[str], Any] = None) -> Any:
         """Call OpenAI API with exponential backoff retry logic"""
-        import random
+        return await self.chat_completion_with_retry(
+            "gpt-4o",  # Use GPT-4o for better context handling
+            [{"role": "user", "content": prompt}],
+            1500,  # Reduced from 2000
+            max_retries,
+            parse=parse
+        )
+    
+    async def chat_completion_with_retry(self, model: str, messages: List[Dict], max_tokens: int,
+                                         max_retries: int = 3, response_format: Dict = None,
+                                         parse: Callable[[str], Any] = None) -> Any:
+        """Reply for one chat completion, from the LLM cache or the API with retry on transient failures
+        
+        With a parse callable the parsed reply is returned (None if it doesn't parse), otherwise the raw text.
+        Only complete replies that parse are cached, so a truncated or malformed one is asked for again next run.
+        """
+        temperature = 0.1
+        cache_key = None
+        if self.llm_cache is not None:
+            cache_key = request_key(model, messages, max_tokens, temperature, response_format)
+            cached = self.llm_cache.get(cache_key)
+            if cached is not None:
+                result = parse(cached) if parse else cached
+                if result is not None:
+                    return result
+        
+        prompt_text = "\n".join(message['content'] for message in messages)
         
         for attempt in range(max_retries + 1):
             try:
-                response = await asyncio.get_event_loop().run_in_executor(
-                    None, 
-                    lambda: openai.ChatCompletion.create(
-                        model="gpt-4o",  # Use GPT-4o for better context handling
-                        messages=[{"role": "user", "content": prompt}],
-                        max_tokens=1500,  # Reduced from 2000
-                        temperature=0.1
+                async with self.openai_semaphore():
+                    await self.rate_limiter.acquire(estimate_tokens(prompt_text, max_tokens))
+                    # Native async request - no thread held open per in-flight call
+                    options = {"response_format": response_format} if response_format else {}
+                    response = await openai.ChatCompletion.acreate(
+                        model=model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        **options
                     )
-                )
-                return response
+                choice = response.choices[0]
+                content = choice.message.content
+                if content is None:
+                    return None
+                result = parse(content) if parse else content
+                if cache_key is not None and result is not None and choice.finish_reason == 'stop':
+                    self.llm_cache.set(cache_key, content, estimate_tokens(prompt_text, max_tokens))
+                return result
                 
             except Exception as e:
                 error_msg = str(e).lower()
                 
-                # Check for rate limiting or context length errors
-                if "rate_limit" in error_msg or "context_length" in error_msg or "tokens per min" in error_msg:
+                # Rate limits, timeouts, dropped connections and server errors are worth retrying
+                if isinstance(e, RETRYABLE_OPENAI_ERRORS) or "rate_limit" in error_msg or \
+                   "context_length" in error_msg or "tokens per min" in error_msg:
                     if attempt < max_retries:
                         # Exponential backoff with jitter
-                        wait_time = (2 ** attempt) + random.uniform(0, 1)
-                        print(f"    Rate limit hit, waiting {wait_time:.1f}s before retry {attempt + 1}/{max_retries}")
+                        wait_time = min(2 ** attempt, OPENAI_MAX_BACKOFF) + random.uniform(0, 1)
+                        print(f"    {type(e).__name__} from OpenAI, waiting {wait_time:.1f}s before retry {attempt + 1}/{max_retries}")
                         await asyncio.sleep(wait_time)
                         continue
                     else:
-                        print(f"    Max retries exceeded for rate limiting: {e}")
+                        print(f"    Max retries exceeded: {e}")
                         return None
                 else:
                     # For other errors, don't retry
@@ -1227,6 +1435,10 @@ class AsyncTravelParser:
         
         return None
     
+    def build_email_batch_prompt(self, email_content: str, gaps_context: str) -> str:
+        """Batch extraction prompt: the fixed instructions first, then this run's gaps, then the emails"""
+        return f"{EMAIL_BATCH_PROMPT_PREFIX}\n{gaps_context}\n\nEMAILS TO ANALYZE:\n{email_content}\n"
+    
     async def analyze_email_batch_with_ai_async(self, emails: List[Dict], gaps_context: str) -> List[Dict]:
         """Analyze a batch of emails with AI, considering all gaps"""
         if not emails:
@@ -1235,77 +1447,18 @@ class AsyncTravelParser:
         batch_start = time.time()
         
         # Prepare email content for AI with reduced content length
-        email_content = ""
-        for email in emails:
-            email_content += f"\n--- EMAIL: {email['file']} ---\n"
-            email_content += f"Date: {email['date']}\n"
-            email_content += f"Subject: {email['subject']}\n"
-            email_content += f"From: {email['sender']}\n"
-            # Reduce content length to prevent context overflow
-            email_content += f"Content: {email['content'][:800]}...\n"  # Reduced from 2000 to 800
+        email_content = "".join(map(format_batch_email, emails))
         
         # Create AI prompt
-        prompt = f"""
-{gaps_context}
-
-Please analyze the following emails and extract any travel information that could fill these gaps. Look for:
-- Flight bookings, confirmations, itineraries
-- Hotel reservations and check-ins
-- Car rentals, train tickets, bus bookings
-- Car lifts, informal transportation
-- Any travel between the gap locations
-- **Multiple flight details in single emails (connected flights, round trips, multi-city itineraries)**
-
-IMPORTANT: If an email contains multiple flight segments (e.g., outbound and return flights, connected flights, layovers), extract ALL of them as separate entries. Each flight segment should be a separate entry in the JSON array.
-
-EMAILS TO ANALYZE:
-{email_content}
-
-Return ONLY a JSON array of travel entries in this format:
-[
-  {{
-    "departure_country": "XX",
-    "departure_city": "City Name",
-    "departure_date": "YYYY-MM-DD",
-    "departure_time": "HH:MM",
-    "arrival_country": "XX", 
-    "arrival_city": "City Name",
-    "arrival_date": "YYYY-MM-DD",
-    "arrival_time": "HH:MM",
-    "notes": "Description",
-    "source_file": "filename.eml"
-  }}
-]
-
-IMPORTANT COUNTRY CODE REQUIREMENTS:
-- Use ISO 3166-1 alpha-2 country codes (2-letter codes only)
-- Examples: GB (United Kingdom), US (United States), FR (France), DE (Germany)
-- Common mappings: UK → GB, United Kingdom → GB, USA → US, United States → US
-- Do NOT use full country names or 3-letter codes
-
-If no travel information is found, return an empty array [].
-"""
+        prompt = self.build_email_batch_prompt(email_content, gaps_context)
         
         try:
             ai_start = time.time()
-            response = await self.call_openai_with_retry(prompt)
+            # Extract the JSON array from the response
+            result = await self.call_openai_with_retry(prompt, parse=parse_json_array)
             ai_time = time.time() - ai_start
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Try to extract JSON from response
-            try:
-                # Look for JSON array in the response
-                json_start = content.find('[')
-                json_end = content.rfind(']') + 1
-                if json_start != -1 and json_end > json_start:
-                    json_str = content[json_start:json_end]
-                    entries = json.loads(json_str)
-                    result = entries if isinstance(entries, list) else []
-                else:
-                    result = []
-            except:
-                result = []
+            if result is None:
+                return []
             
             total_time = time.time() - batch_start
             print(f"    AI call: {ai_time:.2f}s, Total batch: {total_time:.2f}s, Found: {len(result)} entries")
@@ -1325,6 +1478,9 @@ If no travel information is found, return an empty array [].
         print(f"\n🔍 MATCHING {len(all_entries)} EXTRACTED ENTRIES TO GAPS")
         print("=" * 60)
         
+        # Every gap checks the same entries - parse and sort their dates once
+        date_index = index_entries_by_date(all_entries)
+        
         for i, gap in enumerate(self.gaps, 1):
             gap_start = time.time()
             gap_type = "COUNTRY" if gap['is_country_gap'] else "CITY"
@@ -1333,7 +1489,7 @@ If no travel information is found, return an empty array [].
             print(f"\n{priority} GAP #{i}: {gap['current_arrival']} → {gap['next_departure']}")
             
             # Find entries that could fill this gap
-            matching_entries = self.find_entries_for_gap(all_entries, gap)
+            matching_entries = self.find_entries_for_gap(all_entries, gap, date_index)
             
             if matching_entries:
                 print(f"   ✅ Found {len(matching_entries)} potential gap-filling entries")
@@ -1354,25 +1510,34 @@ If no travel information is found, return an empty array [].
         
         return gap_filling_entries
     
-    def find_entries_for_gap(self, all_entries: List[Dict], gap: Dict) -> List[Dict]:
+    def find_entries_for_gap(self, all_entries: List[Dict], gap: Dict,
+                             date_index: Optional[Tuple[List[datetime], List[int]]] = None) -> List[Dict]:
         """Find travel entries that could fill a specific gap"""
         matching_entries = []
         
         try:
-            gap_start = datetime.strptime(gap['current_arrival_date'], '%Y-%m-%d')
-            gap_end = datetime.strptime(gap['next_departure_date'], '%Y-%m-%d')
+            gap_start = parse_iso_date(gap['current_arrival_date'])
+            gap_end = parse_iso_date(gap['next_departure_date'])
+            # The gap locations are the same for every entry - lowercase them once
+            current_arrival = gap['current_arrival'].lower()
+            next_departure = gap['next_departure'].lower()
         except:
             return matching_entries
         
-        for entry in all_entries:
+        dates, positions = date_index or index_entries_by_date(all_entries)
+        
+        # Binary-search the entries within the gap period or slightly before/after,
+        # then check them in their original order
+        lo = bisect_left(dates, gap_start - timedelta(days=7))
+        hi = bisect_right(dates, gap_end + timedelta(days=7))
+        
+        for position in sorted(positions[lo:hi]):
+            entry = all_entries[position]
             try:
-                entry_date = datetime.strptime(entry['departure_date'], '%Y-%m-%d')
-                
-                # Check if entry is within gap period or slightly before/after
-                if (gap_start - timedelta(days=7) <= entry_date <= gap_end + timedelta(days=7)):
-                    # Check if entry connects the gap locations
-                    if self.entry_connects_gap(entry, gap):
-                        matching_entries.append(entry)
+                # Check if entry connects the gap locations
+                if cities_connect_gap(current_arrival, next_departure,
+                                      entry.get('departure_city', '').lower(), entry.get('arrival_city', '').lower()):
+                    matching_entries.append(entry)
             except:
                 continue
         
@@ -1380,16 +1545,8 @@ If no travel information is found, return an empty array [].
     
     def entry_connects_gap(self, entry: Dict, gap: Dict) -> bool:
         """Check if a travel entry connects the gap locations"""
-        # Simple connection logic - can be enhanced
-        current_arrival = gap['current_arrival'].lower()
-        next_departure = gap['next_departure'].lower()
-        
-        entry_departure = entry.get('departure_city', '').lower()
-        entry_arrival = entry.get('arrival_city', '').lower()
-        
-        # Check if entry connects the gap
-        return (current_arrival in entry_departure or entry_departure in current_arrival) and \
-               (next_departure in entry_arrival or entry_arrival in next_departure)
+        return cities_connect_gap(gap['current_arrival'].lower(), gap['next_departure'].lower(),
+                                  entry.get('departure_city', '').lower(), entry.get('arrival_city', '').lower())
     
     def find_emails_for_gap(self, emails: List[Dict], gap: Dict) -> List[Dict]:
         """Find emails that might contain information for a specific gap"""
@@ -1469,45 +1626,29 @@ If no travel information is found, return an empty array [].
         full_context = context + "\n\n" + "\n\n---\n\n".join(email_texts)
         
         try:
-            # Use asyncio to run the OpenAI call in a thread pool
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: openai.ChatCompletion.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": f"You are an expert at finding specific travel connections. Focus ONLY on transportation that connects {gap['current_arrival']} to {gap['next_departure']}. Be very specific and targeted."},
-                        {"role": "user", "content": full_context}
-                    ],
-                    max_tokens=1000,
-                    temperature=0.1
-                )
+            result = await self.chat_completion_with_retry(
+                "gpt-4o",  # JSON mode needs a model that supports response_format
+                [
+                    {"role": "system", "content": f"You are an expert at finding specific travel connections. Focus ONLY on transportation that connects {gap['current_arrival']} to {gap['next_departure']}. Be very specific and targeted."},
+                    {"role": "user", "content": full_context}
+                ],
+                1000,
+                response_format=JSON_RESPONSE_FORMAT,
+                parse=parse_json_object
             )
+            if result is None:
+                print(f"   Could not parse AI response as JSON")
+                return []
+            entries = result.get('travel_entries', [])
             
-            # Parse AI response
-            ai_response = response.choices[0].message.content
+            # Add source file information to each entry
+            for i, entry in enumerate(entries):
+                if i < len(source_files):
+                    entry['source_file'] = source_files[i]
+                else:
+                    entry['source_file'] = source_files[0] if source_files else 'Unknown'
             
-            # Try to extract JSON from response
-            json_match = re.search(r'\{.*\}', ai_response, re.DOTALL)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group())
-                    entries = result.get('travel_entries', [])
-                    
-                    # Add source file information to each entry
-                    for i, entry in enumerate(entries):
-                        if i < len(source_files):
-                            entry['source_file'] = source_files[i]
-                        else:
-                            entry['source_file'] = source_files[0] if source_files else 'Unknown'
-                    
-                    return entries
-                except json.JSONDecodeError:
-                    print(f"   Could not parse AI response as JSON")
-                    return []
-            else:
-                print(f"   No JSON found in AI response")
-                return []
+            return entries
                 
         except Exception as e:
             print(f"   Error calling OpenAI API: {e}")
@@ -1543,55 +1684,38 @@ If no travel information is found, return an empty array [].
         }}
         """
         
-        # Combine email contents for this period with source file tracking
-        email_texts = []
-        source_files = []
-        for email in period_emails[:5]:  # Limit per period
-            email_texts.append(f"Subject: {email['subject']}\nSender: {email['sender']}\nContent: {email['content'][:1500]}")
-            source_files.append(email['file'])
+        # Combine email contents for this period with source file tracking, packed to the prompt token budget
+        email_texts, source_files = pack_email_texts(
+            period_emails[:5],  # Limit per period
+            PERIOD_PROMPT_TOKEN_BUDGET - estimate_tokens(context, 0)
+        )
         
-        full_context = context + "\n\n" + "\n\n---\n\n".join(email_texts)
+        full_context = context + "\n\n" + EMAIL_SEPARATOR.join(email_texts)
         
         try:
-            # Use asyncio to run the OpenAI call in a thread pool
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: openai.ChatCompletion.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "You are an expert at extracting travel information from emails. Extract all travel-related information you can find."},
-                        {"role": "user", "content": full_context}
-                    ],
-                    max_tokens=2000,
-                    temperature=0.1
-                )
+            result = await self.chat_completion_with_retry(
+                "gpt-4o",  # JSON mode needs a model that supports response_format
+                [
+                    {"role": "system", "content": "You are an expert at extracting travel information from emails. Extract all travel-related information you can find."},
+                    {"role": "user", "content": full_context}
+                ],
+                2000,
+                response_format=JSON_RESPONSE_FORMAT,
+                parse=parse_json_object
             )
+            if result is None:
+                print(f"Could not parse AI response as JSON for {period}")
+                return []
+            entries = result.get('travel_entries', [])
             
-            # Parse AI response
-            ai_response = response.choices[0].message.content
+            # Add source file information to each entry
+            for i, entry in enumerate(entries):
+                if i < len(source_files):
+                    entry['source_file'] = source_files[i]
+                else:
+                    entry['source_file'] = source_files[0] if source_files else 'Unknown'
             
-            # Try to extract JSON from response
-            json_match = re.search(r'\{.*\}', ai_response, re.DOTALL)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group())
-                    entries = result.get('travel_entries', [])
-                    
-                    # Add source file information to each entry
-                    for i, entry in enumerate(entries):
-                        if i < len(source_files):
-                            entry['source_file'] = source_files[i]
-                        else:
-                            entry['source_file'] = source_files[0] if source_files else 'Unknown'
-                    
-                    return entries
-                except json.JSONDecodeError:
-                    print(f"Could not parse AI response as JSON for {period}")
-                    return []
-            else:
-                print(f"No JSON found in AI response for {period}")
-                return []
+            return entries
                 
         except Exception as e:
             print(f"Error calling OpenAI API for {period}: {e}")
@@ -1644,20 +1768,32 @@ If no travel information is found, return an empty array [].
         print("\n🔗 ANALYZING CONNECTIONS BETWEEN CONSECUTIVE ENTRIES")
         print("=" * 60)
         
-        # Add connection analysis columns to each entry
-        for i in range(len(data)):
-            entry = data[i].copy()
-            
-            if i < len(data) - 1:  # Not the last entry
+        country_matches = 0
+        city_matches = 0
+        
+        # Add connection analysis columns to each entry, in place - no per-row copies
+        last_index = len(data) - 1
+        for i, entry in enumerate(data):
+            if i < last_index:  # Not the last entry
                 next_entry = data[i + 1]
+                arrival_city = entry.get('arrival_city', '')
+                departure_city = next_entry.get('departure_city', '')
+                
+                # Nothing to compare when neither side has a location
+                if arrival_city in ('', 'Unknown') and departure_city in ('', 'Unknown'):
+                    entry['next_country_match'] = '❌'
+                    entry['next_city_match'] = '❌'
+                    entry['next_country'] = 'Unknown'
+                    entry['next_city'] = 'Unknown'
+                    continue
                 
                 # Extract country and city from current entry
-                current_country = self.extract_country(entry.get('arrival_city', ''))
-                current_city = self.extract_city(entry.get('arrival_city', ''))
+                current_country = self.extract_country(arrival_city)
+                current_city = self.extract_city(arrival_city)
                 
                 # Extract country and city from next entry
-                next_country = self.extract_country(next_entry.get('departure_city', ''))
-                next_city = self.extract_city(next_entry.get('departure_city', ''))
+                next_country = self.extract_country(departure_city)
+                next_city = self.extract_city(departure_city)
                 
                 # Check if countries match
                 country_match = current_country.lower() == next_country.lower() if current_country and next_country else False
@@ -1665,6 +1801,10 @@ If no travel information is found, return an empty array [].
                 # Check if cities match
                 city_match = current_city.lower() == next_city.lower() if current_city and next_city else False
                 
+                # Count matches as we go
+                country_matches += country_match
+                city_matches += city_match
+                
                 # Add analysis columns
                 entry['next_country_match'] = '✅' if country_match else '❌'
                 entry['next_city_match'] = '✅' if city_match else '❌'
@@ -1673,23 +1813,17 @@ If no travel information is found, return an empty array [].
                 
                 # Log the analysis
                 if country_match or city_match:
-                    print(f"  {i+1}. {entry.get('arrival_city', 'Unknown')} → {next_entry.get('departure_city', 'Unknown')}")
+                    logger.info("  %d. %s → %s", i + 1, entry.get('arrival_city', 'Unknown'), next_entry.get('departure_city', 'Unknown'))
                     if country_match:
-                        print(f"     ✅ Country match: {current_country}")
+                        logger.info("     ✅ Country match: %s", current_country)
                     if city_match:
-                        print(f"     ✅ City match: {current_city}")
+                        logger.info("     ✅ City match: %s", current_city)
             else:
                 # Last entry - no next entry to compare
                 entry['next_country_match'] = 'N/A'
                 entry['next_city_match'] = 'N/A'
                 entry['next_country'] = 'N/A'
                 entry['next_city'] = 'N/A'
-            
-            data[i] = entry
-        
-        # Count matches
-        country_matches = sum(1 for entry in data if entry.get('next_country_match') == '✅')
-        city_matches = sum(1 for entry in data if entry.get('next_city_match') == '✅')
         
         print(f"\n📊 CONNECTION ANALYSIS SUMMARY:")
         print(f"   • Country matches: {country_matches}/{len(data)-1}")
@@ -1703,116 +1837,109 @@ If no travel information is found, return an empty array [].
         if not location or location == 'Unknown':
             return ''
         
-        # Look for country code in parentheses
-        import re
-        match = re.search(r'\(([A-Z]{2})\)', location)
-        if match:
-            return match.group(1)
-        
-        # If no country code, return the full location
-        return location
+        return _extract_country(location)
     
     def extract_city(self, location: str) -> str:
         """Extract city from location string (e.g., 'London (GB)' -> 'London')"""
         if not location or location == 'Unknown':
             return ''
-        
-        # Remove country code in parentheses
-        import re
-        city = re.sub(r'\s*\([A-Z]{2}\)', '', location).strip()
-        return city
+        return _extract_city(location)
     
     async def run_async(self):
         """Run the complete gap finding process with async processing"""
-        print(f"Starting Async Travel Parser with {self.max_workers} workers...")
-        overall_start = time.time()
-        
-        # Load existing data
-        load_start = time.time()
-        self.load_travel_data()
-        load_time = time.time() - load_start
-        print(f"📊 Data loading: {load_time:.2f}s")
-        
-        # Identify gaps
-        gap_start = time.time()
-        self.identify_gaps()
-        gap_time = time.time() - gap_start
-        print(f"📊 Gap identification: {gap_time:.2f}s")
-        
-        # Search for travel-related emails asynchronously (with gap location filtering)
-        search_start = time.time()
-        travel_emails = await self.search_travel_emails_async()
-        search_time = time.time() - search_start
-        print(f"📊 Email search: {search_time:.2f}s")
-        
-        if travel_emails:
-            # Analyze emails with AI asynchronously
-            ai_start = time.time()
-            raw_entries = await self.extract_travel_info_with_ai_async(travel_emails)
-            ai_time = time.time() - ai_start
-            print(f"📊 AI processing: {ai_time:.2f}s")
+        try:
+            print(f"Starting Async Travel Parser with {self.max_workers} workers...")
+            overall_start = time.time()
             
-            # Clean and validate entries with source file information
-            clean_start = time.time()
-            self.found_entries = []
-            for entry in raw_entries:
-                source_file = entry.get('source_file', 'Unknown')
-                cleaned_entry = self.clean_travel_entry(entry, source_file)
-                self.found_entries.append(cleaned_entry)
-            clean_time = time.time() - clean_start
-            print(f"📊 Entry cleaning: {clean_time:.2f}s")
+            # Load existing data
+            load_start = time.time()
+            self.load_travel_data()
+            load_time = time.time() - load_start
+            print(f"📊 Data loading: {load_time:.2f}s")
             
-            print(f"Found {len(self.found_entries)} potential travel entries from emails")
+            # Identify gaps
+            gap_start = time.time()
+            self.identify_gaps()
+            gap_time = time.time() - gap_start
+            print(f"📊 Gap identification: {gap_time:.2f}s")
             
-            # Print found entries for debugging
-            print("\nFound travel entries:")
-            for i, entry in enumerate(self.found_entries):
-                print(f"  {i+1}. {entry.get('departure_city', 'Unknown')} -> {entry.get('arrival_city', 'Unknown')} on {entry.get('departure_date', 'Unknown')} (from {entry.get('source_file', 'Unknown')})")
-        else:
-            print("No travel-related emails found")
-        
-        # Detect incongruent events in original data
-        incongruent_events = self.detect_incongruent_events(self.travel_data)
-        
-        # Generate complete table
-        complete_data = self.generate_complete_table()
-        
-        # Add connection analysis columns
-        complete_data = self.add_connection_analysis(complete_data)
-        
-        # Check if gaps are filled
-        gaps_filled, gaps_remaining = self.check_gaps_filled(complete_data)
-        
-        # Save results with timestamped filename matching input style
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M")
-        output_file = f"all-travel-{timestamp}.csv"
-        self.save_complete_table(complete_data, output_file)
-        
-        end_time = time.time()
-        total_time = end_time - overall_start
-        
-        print(f"\n🎉 PROCESS COMPLETE!")
-        print(f"📊 PERFORMANCE SUMMARY:")
-        print(f"   • Total time: {total_time:.2f}s")
-        print(f"   • Data loading: {load_time:.2f}s ({load_time/total_time*100:.1f}%)")
-        print(f"   • Gap identification: {gap_time:.2f}s ({gap_time/total_time*100:.1f}%)")
-        print(f"   • Email search: {search_time:.2f}s ({search_time/total_time*100:.1f}%)")
-        if travel_emails:
-            print(f"   • AI processing: {ai_time:.2f}s ({ai_time/total_time*100:.1f}%)")
-            print(f"   • Entry cleaning: {clean_time:.2f}s ({clean_time/total_time*100:.1f}%)")
-        print(f"📊 RESULTS:")
-        print(f"   • Found {len(self.found_entries)} potential travel entries from emails")
-        print(f"   • Gaps filled: {gaps_filled}/{len(self.gaps)} ({gaps_filled/len(self.gaps)*100:.1f}%)")
-        print(f"   • Gaps remaining: {gaps_remaining}")
-        print(f"   • Incongruent events detected: {len(incongruent_events)}")
-        print(f"   • Complete itinerary saved to: {output_file}")
-        if travel_emails:
-            print(f"   • Processing rate: {len(travel_emails)/total_time:.1f} emails/sec")
-            print(f"   • AI efficiency: {len(self.found_entries)/len(travel_emails)*100:.1f}% of emails yielded travel entries")
+            # Search for travel-related emails asynchronously (with gap location filtering)
+            search_start = time.time()
+            travel_emails = await self.search_travel_emails_async()
+            search_time = time.time() - search_start
+            print(f"📊 Email search: {search_time:.2f}s")
+            
+            if travel_emails:
+                # Analyze emails with AI asynchronously
+                ai_start = time.time()
+                raw_entries = await self.extract_travel_info_with_ai_async(travel_emails)
+                ai_time = time.time() - ai_start
+                print(f"📊 AI processing: {ai_time:.2f}s")
+                
+                # Clean and validate entries with source file information
+                clean_start = time.time()
+                self.found_entries = []
+                for entry in raw_entries:
+                    source_file = entry.get('source_file', 'Unknown')
+                    cleaned_entry = self.clean_travel_entry(entry, source_file)
+                    self.found_entries.append(cleaned_entry)
+                clean_time = time.time() - clean_start
+                print(f"📊 Entry cleaning: {clean_time:.2f}s")
+                
+                print(f"Found {len(self.found_entries)} potential travel entries from emails")
+                
+                # Print found entries for debugging
+                print("\nFound travel entries:")
+                for i, entry in enumerate(self.found_entries):
+                    print(f"  {i+1}. {entry.get('departure_city', 'Unknown')} -> {entry.get('arrival_city', 'Unknown')} on {entry.get('departure_date', 'Unknown')} (from {entry.get('source_file', 'Unknown')})")
+            else:
+                print("No travel-related emails found")
+            
+            # Detect incongruent events in original data
+            incongruent_events = self.detect_incongruent_events(self.travel_data)
+            
+            # Generate complete table
+            complete_data = self.generate_complete_table()
+            
+            # Add connection analysis columns
+            complete_data = self.add_connection_analysis(complete_data)
+            
+            # Check if gaps are filled
+            gaps_filled, gaps_remaining = self.check_gaps_filled(complete_data)
+            
+            # Save results with timestamped filename matching input style
+            output_file = self.make_output_filename(datetime.now())
+            self.save_complete_table(complete_data, output_file)
+            
+            end_time = time.time()
+            total_time = end_time - overall_start
+            
+            print(f"\n🎉 PROCESS COMPLETE!")
+            print(f"📊 PERFORMANCE SUMMARY:")
+            print(f"   • Total time: {total_time:.2f}s")
+            print(f"   • Data loading: {load_time:.2f}s ({load_time/total_time*100:.1f}%)")
+            print(f"   • Gap identification: {gap_time:.2f}s ({gap_time/total_time*100:.1f}%)")
+            print(f"   • Email search: {search_time:.2f}s ({search_time/total_time*100:.1f}%)")
+            if travel_emails:
+                print(f"   • AI processing: {ai_time:.2f}s ({ai_time/total_time*100:.1f}%)")
+                print(f"   • Entry cleaning: {clean_time:.2f}s ({clean_time/total_time*100:.1f}%)")
+            print(f"📊 RESULTS:")
+            print(f"   • Found {len(self.found_entries)} potential travel entries from emails")
+            print(f"   • Gaps filled: {gaps_filled}/{len(self.gaps)} ({gaps_filled/len(self.gaps)*100:.1f}%)")
+            print(f"   • Gaps remaining: {gaps_remaining}")
+            print(f"   • Incongruent events detected: {len(incongruent_events)}")
+            print(f"   • Complete itinerary saved to: {output_file}")
+            if travel_emails:
+                print(f"   • Processing rate: {len(travel_emails)/total_time:.1f} emails/sec")
+                print(f"   • AI efficiency: {len(self.found_entries)/len(travel_emails)*100:.1f}% of emails yielded travel entries")
+        finally:
+            # Workers started by any email parsing in this run are shut down even if a step fails
+            self.close_process_pool()
     
     def run(self):
         """Synchronous wrapper for async run"""
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         asyncio.run(self.run_async())
     
     def generate_complete_table(self):
@@ -1821,35 +1948,35 @@ If no travel information is found, return an empty array [].
         
         # Create new table with gaps filled
         complete_data = []
-        used_entries = set()  # Track which found entries we've used
+        
+        # Queue found entries by (departure, arrival) city so each gap takes the first unused match directly
+        by_pair = {}
+        for j, found_entry in enumerate(self.found_entries):
+            key = (_city_match_key(found_entry.get('departure_city', '')),
+                   _city_match_key(found_entry.get('arrival_city', '')))
+            by_pair.setdefault(key, deque()).append(j)
         
         for i, entry in enumerate(self.travel_data):
-            # Add source_file field to existing entries (set to 'Original' for existing data)
-            entry_with_source = entry.copy()
-            entry_with_source['source_file'] = 'Original'
-            complete_data.append(entry_with_source)
+            # Add source_file field to existing entries (set to 'Original' for existing data) -
+            # the loaded rows go into the table as-is rather than as per-row copies
+            entry['source_file'] = 'Original'
+            complete_data.append(entry)
             
             # Check if there's a gap after this entry
             if i < len(self.travel_data) - 1:
-                current_arrival = self.extract_city_name(entry['arrival_city'])
-                next_departure = self.extract_city_name(self.travel_data[i + 1]['departure_city'])
+                next_entry = self.travel_data[i + 1]
                 
                 # Look for a travel entry that fills this gap
-                for j, found_entry in enumerate(self.found_entries):
-                    if j in used_entries:
-                        continue
-                    
-                    found_departure = self.extract_city_name(found_entry.get('departure_city', ''))
-                    found_arrival = self.extract_city_name(found_entry.get('arrival_city', ''))
-                    
-                    # Check if this entry fills the gap
-                    if (found_departure.lower() == current_arrival.lower() and 
-                        found_arrival.lower() == next_departure.lower()):
-                        
-                        complete_data.append(found_entry)
-                        used_entries.add(j)
-                        print(f"✅ FILLED GAP: {current_arrival} → {next_departure} (via {found_entry.get('departure_city', 'Unknown')} → {found_entry.get('arrival_city', 'Unknown')} from {found_entry.get('source_file', 'Unknown')})")
-                        break
+                candidates = by_pair.get((_city_match_key(entry['arrival_city']),
+                                          _city_match_key(next_entry['departure_city'])))
+                if candidates:
+                    found_entry = self.found_entries[candidates.popleft()]
+                    complete_data.append(found_entry)
+                    current_arrival = self.extract_city_name(entry['arrival_city'])
+                    next_departure = self.extract_city_name(next_entry['departure_city'])
+                    logger.info("✅ FILLED GAP: %s → %s (via %s → %s from %s)", current_arrival, next_departure,
+                                found_entry.get('departure_city', 'Unknown'), found_entry.get('arrival_city', 'Unknown'),
+                                found_entry.get('source_file', 'Unknown'))
         
         return complete_data
     
@@ -1860,21 +1987,16 @@ If no travel information is found, return an empty array [].
         
         incongruent_events = []
         
-        # Group entries by departure city and date
+        # Group entry positions by departure city and date
         city_departures = {}
-        for entry in travel_data:
-            city = entry['departure_city']
-            date = entry['departure_date']
-            key = f"{city}_{date}"
-            
-            if key not in city_departures:
-                city_departures[key] = []
-            city_departures[key].append(entry)
+        for index, entry in enumerate(travel_data):
+            key = (entry['departure_city'], entry['departure_date'])
+            city_departures.setdefault(key, []).append(index)
         
         # Find cities with multiple departures on same date
-        for key, entries in city_departures.items():
-            if len(entries) > 1:
-                city, date = key.split('_', 1)
+        for (city, date), indices in city_departures.items():
+            if len(indices) > 1:
+                entries = [travel_data[index] for index in indices]
                 event = {
                     'type': 'multiple_departures',
                     'city': city,
@@ -1884,43 +2006,57 @@ If no travel information is found, return an empty array [].
                     'description': f"Multiple departures from {city} on {date}"
                 }
                 incongruent_events.append(event)
-                print(f"⚠️  INCONGRUENT: {event['description']} ({len(entries)} entries)")
-        
-        # Check for overlapping time periods
-        for i, entry1 in enumerate(travel_data):
-            for j, entry2 in enumerate(travel_data[i+1:], i+1):
-                if (entry1['departure_city'] == entry2['departure_city'] and
-                    entry1['departure_date'] == entry2['departure_date'] and
-                    entry1['departure_time'] and entry2['departure_time']):
-                    
-                    # Check if times are close (within 2 hours)
+                logger.info("⚠️  INCONGRUENT: %s (%d entries)", event['description'], len(entries))
+        
+        # Check for overlapping time periods - only entries sharing a city and date can overlap,
+        # so compare pairs within each group instead of every pair in the itinerary
+        overlapping_pairs = []
+        for indices in city_departures.values():
+            if len(indices) < 2:
+                continue
+            
+            # Parse each departure time once; entries without a usable time are never compared
+            times = {}
+            for index in indices:
+                departure_time = travel_data[index]['departure_time']
+                if departure_time:
                     try:
-                        time1 = datetime.strptime(entry1['departure_time'], '%H:%M')
-                        time2 = datetime.strptime(entry2['departure_time'], '%H:%M')
-                        time_diff = abs((time1 - time2).total_seconds() / 3600)
-                        
-                        if time_diff < 2:  # Less than 2 hours apart
-                            event = {
-                                'type': 'overlapping_times',
-                                'city': entry1['departure_city'],
-                                'date': entry1['departure_date'],
-                                'time1': entry1['departure_time'],
-                                'time2': entry2['departure_time'],
-                                'entries': [entry1, entry2],
-                                'description': f"Overlapping departures from {entry1['departure_city']} on {entry1['departure_date']} at {entry1['departure_time']} and {entry2['departure_time']}"
-                            }
-                            incongruent_events.append(event)
-                            print(f"⚠️  OVERLAPPING: {event['description']}")
+                        times[index] = datetime.strptime(departure_time, '%H:%M')
                     except:
                         pass
+            
+            timed = [index for index in indices if index in times]
+            for position, first in enumerate(timed):
+                for second in timed[position + 1:]:
+                    time_diff = abs((times[first] - times[second]).total_seconds() / 3600)
+                    if time_diff < 2:  # Less than 2 hours apart
+                        overlapping_pairs.append((first, second))
+        
+        # Report overlaps in itinerary order
+        overlapping_pairs.sort()
+        for first, second in overlapping_pairs:
+            entry1 = travel_data[first]
+            entry2 = travel_data[second]
+            event = {
+                'type': 'overlapping_times',
+                'city': entry1['departure_city'],
+                'date': entry1['departure_date'],
+                'time1': entry1['departure_time'],
+                'time2': entry2['departure_time'],
+                'entries': [entry1, entry2],
+                'description': f"Overlapping departures from {entry1['departure_city']} on {entry1['departure_date']} at {entry1['departure_time']} and {entry2['departure_time']}"
+            }
+            incongruent_events.append(event)
+            logger.info("⚠️  OVERLAPPING: %s", event['description'])
         
         if not incongruent_events:
             print("✅ No incongruent events detected")
         else:
+            event_counts = Counter(event['type'] for event in incongruent_events)
             print(f"\n📊 INCONGRUENT EVENTS SUMMARY:")
             print(f"   • Total events: {len(incongruent_events)}")
-            print(f"   • Multiple departures: {len([e for e in incongruent_events if e['type'] == 'multiple_departures'])}")
-            print(f"   • Overlapping times: {len([e for e in incongruent_events if e['type'] == 'overlapping_times'])}")
+            print(f"   • Multiple departures: {event_counts['multiple_departures']}")
+            print(f"   • Overlapping times: {event_counts['overlapping_times']}")
         
         print("=" * 60)
         return incongruent_events
@@ -1971,6 +2107,11 @@ If no travel information is found, return an empty array [].
         
         return gaps_filled, gaps_remaining
     
+    @staticmethod
+    def make_output_filename(now: datetime) -> str:
+        """Timestamped output filename matching the input style, e.g. all-travel-20250916-2241.csv"""
+        return f"all-travel-{now:%Y%m%d-%H%M}.csv"
+    
     def save_complete_table(self, complete_data: List[Dict], output_file: str):
         """Save complete travel table to CSV with chronological sorting"""
         print(f"Saving complete table to {output_file}...")
@@ -1985,10 +2126,21 @@ If no travel information is found, return an empty array [].
             'source_file', 'next_country_match', 'next_city_match', 'next_country', 'next_city'
         ]
         
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(complete_data)
+        # Write beside the target and swap it in, so an interrupted save never leaves a truncated CSV
+        temp_file = output_file + '.tmp'
+        try:
+            with open(temp_file, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(complete_data)
+            os.replace(temp_file, output_file)
+        except BaseException:
+            # Don't leave the partial file behind, whatever stopped the save
+            try:
+                os.unlink(temp_file)
+            except FileNotFoundError:
+                pass
+            raise
         
         print(f"Complete table saved with {len(complete_data)} entries (chronologically sorted)")
 
@@ -1999,9 +2151,14 @@ def main():
     parser.add_argument('--workers', type=int, default=8, help='Number of parallel workers')
     parser.add_argument('--gaps-only', action='store_true', help='Only identify gaps, do not process emails')
     parser.add_argument('--check-gaps', help='Check if gaps are filled in existing CSV file')
+    parser.add_argument('--no-cache', action='store_true', help='Always call OpenAI instead of reusing cached responses')
+    parser.add_argument('--verbose', action='store_true', help='Log every filled gap, connection match and incongruent event')
     
     args = parser.parse_args()
     
+    # Per-entry detail is only formatted when asked for
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    
     # Check if files exist
     if not os.path.exists(args.csv):
         print(f"❌ Error: CSV file {args.csv} not found!")
@@ -2013,7 +2170,7 @@ def main():
             return
     
     # Create parser instance
-    travel_parser = AsyncTravelParser(args.csv, args.emails, args.workers)
+    travel_parser = AsyncTravelParser(args.csv, args.emails, args.workers, use_llm_cache=not args.no_cache)
     
     if args.check_gaps:
         # Check gaps in existing file
@@ -2024,7 +2181,7 @@ def main():
         
         # Load the file to check
         check_data = []
-        with open(args.check_gaps, 'r', encoding='utf-8') as f:
+        with open(args.check_gaps, 'r', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE) as f:
             reader = csv.DictReader(f)
             check_data = list(reader)
         
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+LLM Cache - SQLite store of OpenAI responses keyed by a hash of the request
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import time
+from typing import List, Dict, Optional
+
+# Kept next to the scripts, so every run shares one cache whatever the working directory
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'llm_cache.sqlite')
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60  # 30 days
+DEFAULT_MAX_ENTRIES = 10000
+
+def request_key(model: str, messages: List[Dict], max_tokens: int, temperature: float,
+                response_format: Dict = None) -> str:
+    """SHA-256 of everything that determines a chat completion's reply"""
+    request = json.dumps({"m": model, "msgs": messages, "mt": max_tokens, "t": temperature, "rf": response_format},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._connection = None
+        self._entries = 0  # rows stored, an upper bound between trims (replacing a key counts again)
+        self._failed = False  # set once the database can't be used; the cache is then bypassed
+
+    def connection(self) -> sqlite3.Connection:
+        """Open the cache database on first use, creating the table and its expiry index if needed"""
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(hash TEXT PRIMARY KEY, response TEXT, created_at INTEGER, last_used INTEGER, cost INTEGER DEFAULT 0)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)"
+            )
+            self._entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return self._connection
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached response for a key, or None if missing or older than the TTL (a hit counts as a use)"""
+        if self._failed:
+            return None
+        now = int(time.time())
+        try:
+            connection = self.connection()
+            row = connection.execute(
+                "SELECT response FROM responses WHERE hash = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            with connection:
+                connection.execute("UPDATE responses SET last_used = ? WHERE hash = ?", (now, key))
+        except (sqlite3.Error, OSError) as e:
+            self._fail(e)
+            return None
+        return row[0]
+
+    def set(self, key: str, response: str, cost: int = 0):
+        """Store a response and its request's token cost, replacing any older one for the same key"""
+        if self._failed:
+            return
+        now = int(time.time())
+        try:
+            connection = self.connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (hash, response, created_at, last_used, cost) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, now, now, cost)
+                )
+                self._entries += 1
+                if self._entries > self.max_entries:
+                    self._evict(connection, now)
+        except (sqlite3.Error, OSError) as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception):
+        """Warn that the cache database is unusable (corrupt, locked or read-only) and stop using it this run"""
+        print(f"⚠️  Not using LLM cache {self.path}: {error}")
+        self._failed = True
+        self.close()
+
+    def _evict(self, connection: sqlite3.Connection, now: int):
+        """Once the cache may be over max_entries: drop expired entries, then the least valuable ones beyond it"""
+        connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._entries = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        excess = self._entries - self.max_entries
+        if excess > 0:
+            # Idle time per token of the request: a long, expensive batch has to sit unused much
+            # longer than a cheap prompt before it goes, so the slowest requests stay cached
+            connection.execute(
+                "DELETE FROM responses WHERE hash IN (SELECT hash FROM responses "
+                "ORDER BY (? - last_used + 1) * 1.0 / (cost + 1) DESC LIMIT ?)",
+                (now, excess)
+            )
+            self._entries = self.max_entries
+
+    def close(self):
+        """Close the database connection"""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None